@@ -1,5 +1,7 @@
 import os
 import sys
+import cv2
+import math
 import time
 import glob
 import json
@@ -9,11 +11,14 @@ import warnings
 import argparse
 import numpy as np
 import torchvision
+import torchaudio
 import cmasher as cmr
 from datetime import datetime
 from omegaconf import OmegaConf
 import matplotlib.pyplot as plt
 
+MODULE_DIR = os.path.dirname(os.path.abspath(__file__))
+
 sys.path.append('Synchformer/')
 sys.path.append('av_sync_detection/Synchformer/')
 sys.path.append('Synchformer/model/modules/feat_extractors/visual/')
@@ -46,8 +51,8 @@ class AVSyncDetection():
 
         # if the model does not exist try to download it from the server
         exp_name = '24-01-04T16-39-21'
-        cfg_path = f'Synchformer/logs/sync_models/{exp_name}/cfg-{exp_name}.yaml'
-        self.ckpt_path = f'Synchformer/logs/sync_models/{exp_name}/{exp_name}.pt'
+        cfg_path = os.path.join(MODULE_DIR, f'Synchformer/logs/sync_models/{exp_name}/cfg-{exp_name}.yaml')
+        self.ckpt_path = os.path.join(MODULE_DIR, f'Synchformer/logs/sync_models/{exp_name}/{exp_name}.pt')
         check_if_file_exists_else_download(cfg_path)
         check_if_file_exists_else_download(self.ckpt_path)
 
@@ -109,11 +114,8 @@ class AVSyncDetection():
 
         while True:
             if len(segment_file_paths) > 0:
+                # Capture only gives segments their final name once they are completely written
                 video_path = segment_file_paths[0]
-
-                if len(segment_file_paths) == 1: time.sleep(self.retry_wait_time // 2)
-                if not os.access(video_path, os.R_OK): time.sleep(self.retry_wait_time)
-
                 predictions = self.video_detection(video_path)
                 video_id = pathlib.Path(video_path).stem
                 self.video_detection_results.update({video_id: predictions})
@@ -149,6 +151,22 @@ class AVSyncDetection():
 
         if output_to_file: self.write_results_file(output_directory)
 
+    def process_segment(self, segments, plot=False, time_indexed_files=True, output_directory='./'):
+        # Run detection over paired audio/video segments handed over in memory by the capture processor
+        video_segment, audio_segment = segments['video'], segments['audio']
+        predictions = self.segment_detection(
+            video_segment['frames'], video_segment['fps'],
+            audio_segment['samples'], audio_segment['sample_rate']
+        )
+
+        start_time = video_segment['start_time'].strftime('%H:%M:%S.%f')
+        end_time = video_segment['end_time'].strftime('%H:%M:%S.%f')
+        video_id = f"seg{segments['index']}_{start_time}_{end_time}"
+        self.video_detection_results.update({video_id: predictions})
+        self.video_segment_index += 1
+
+        if plot: self.plot(output_directory, time_indexed_files)
+
     def get_local_paths(self, dir, time_indexed_files=False):
         video_filenames = glob.glob(f"{dir}*.mp4")
 
@@ -168,22 +186,55 @@ class AVSyncDetection():
     def video_detection(self, vid_path):
         print(f"\n--------------------------------------------------------------------------------\n")
 
-        # Check file exists & is accessible
-        if not os.path.isfile(vid_path) or not os.access(vid_path, os.R_OK):
-            time.sleep(self.retry_wait_time // 2)
-            if not os.path.isfile(vid_path): return []
-
-        # checking if the provided video has the correct frame rates
-        print(f'Using video: {vid_path}')
-        v, _, info = torchvision.io.read_video(vid_path, pts_unit='sec')
-        _, H, W, _ = v.shape
-        if 'video_fps' not in info or 'audio_fps' not in info or info['video_fps'] != self.vfps or info['audio_fps'] != self.afps or min(H, W) != self.in_size:
-            vid_path = reencode_video(vid_path, self.vfps, self.afps, self.in_size)
+        # Check file exists
+        if not os.path.isfile(vid_path): return []
+
+        # Use the proxy rendition written at capture time (already in the model's input format) if there is one
+        proxy_path = os.path.join(os.path.dirname(vid_path), "proxy", os.path.basename(vid_path))
+        if os.path.isfile(proxy_path):
+            # The proxy is written in the model's input format, so skip decoding it just to check the frame rates
+            vid_path = proxy_path
+            print(f'Using proxy video: {vid_path}')
         else:
-            print(f'Skipping reencoding. vfps: {info["video_fps"]}; afps: {info["audio_fps"]}; min(H, W)={self.in_size}')
+            # checking if the provided video has the correct frame rates
+            print(f'Using video: {vid_path}')
+            v, _, info = torchvision.io.read_video(vid_path, pts_unit='sec')
+            _, H, W, _ = v.shape
+            if 'video_fps' not in info or 'audio_fps' not in info or info['video_fps'] != self.vfps or info['audio_fps'] != self.afps or min(H, W) != self.in_size:
+                vid_path = reencode_video(vid_path, self.vfps, self.afps, self.in_size)
+            else:
+                print(f'Skipping reencoding. vfps: {info["video_fps"]}; afps: {info["audio_fps"]}; min(H, W)={self.in_size}')
 
         rgb, audio, meta = get_video_and_audio(vid_path, get_meta=True)
 
+        return self.predict(rgb, audio, meta, vid_path)
+
+    def segment_detection(self, frames, video_fps, audio_samples, audio_fps):
+        print("\n--------------------------------------------------------------------------------\n")
+
+        # Resample captured BGR frames to the model frame rate and scale the shortest side to the model input size
+        frame_count = math.floor(len(frames) * self.vfps / video_fps)
+        frame_indices = np.minimum(np.round(np.arange(frame_count) * video_fps / self.vfps).astype(int), len(frames) - 1)
+        height, width = frames.shape[1:3]
+        scale = self.in_size / min(height, width)
+        frame_size = (2 * round(width * scale / 2), 2 * round(height * scale / 2))
+
+        rgb = np.stack([
+            cv2.cvtColor(cv2.resize(frames[i], frame_size, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2RGB)
+            for i in frame_indices
+        ])
+        rgb = torch.from_numpy(rgb).permute(0, 3, 1, 2)  # dimensions (T, C, H, W)
+
+        # Mix int16 capture audio down to mono float and resample to the model sample rate
+        audio = torch.from_numpy(audio_samples.astype(np.float32) / 32768).mean(dim=0)
+        audio = torchaudio.functional.resample(audio, int(audio_fps), self.afps)
+
+        print(f'Using in-memory segment: {tuple(rgb.shape)} video, {tuple(audio.shape)} audio')
+        meta = {'video': {'fps': [self.vfps]}, 'audio': {'framerate': [self.afps]}}
+
+        return self.predict(rgb, audio, meta)
+
+    def predict(self, rgb, audio, meta, vid_path=''):
         # making an item (dict) to apply transformations
         item = dict(
             video=rgb, audio=audio, meta=meta, path=vid_path, split='test',
@@ -1,10 +1,16 @@
 import math
-import cv2
+import time
+import datetime
 import numpy as np
 import pyaudio
 import wave
 from moviepy.editor import VideoFileClip, AudioFileClip, CompositeAudioClip
 
+from CaptureClock import CaptureClock
+from SegmentScheduler import SegmentScheduler
+from IndexedSegment import IndexedSegmentWriter
+from SegmentWriter import SegmentWriterPool
+
 
 Object = lambda **kwargs: type("Object", (), kwargs)
 
@@ -13,7 +19,7 @@ class AudioVisualProcessor():
     def __init__(self, video_fps=30, video_shape=(), audio_fps=44100, audio_chunk_size=1024,
                  audio_buffer_len_s=20, audio_overlap_len_s=1,
                  video_buffer_len_s=20, video_overlap_len_s=1,
-                 audio_save_path='', video_save_path=''):
+                 audio_save_path='', video_save_path='', video_container='mp4', clock=None, telemetry=None, name=''):
 
         self.audio_fps = audio_fps
         self.video_fps = video_fps
@@ -29,15 +35,68 @@ class AudioVisualProcessor():
 
         self.save_audio_files = True
         self.save_video_files = True
+        self.audio_write_buffer = None
         self.audio_save_path = audio_save_path
         self.video_save_path = video_save_path
+        self.video_container = video_container
+
+        # Indexed (mjpeg) segments are written a frame at a time as frames are queued rather than once collated. The
+        # segment's (timestamp_ns, frame, slot) entries are taken off the capture queue as they are written.
+        self.stream_video = False
+        self.video_stream_writer = None
+        self.video_stream_file = ''
+        self.video_stream_entries = []
+        self.video_streamed = 0
+
+        # Frames are stamped with monotonic capture times, only converted to wall clock time for segment names
+        self.clock = clock if clock is not None else CaptureClock()
+        self.telemetry = telemetry
+
+        # Label for output when several processors (capture rigs) run in one process
+        self.name = name
+        self.log_prefix = f"[{name}] " if name else ''
 
     def process(self,
                 audio_module=Object(stream_open=False), audio_frames=[], audio_channels=1,
                 video_module=Object(stream_open=False, video_device=None), video_frames=[],
-                checkpoint_files=True, audio_on=True, video_on=True):
+                checkpoint_files=True, audio_on=True, video_on=True, scheduler=None, video_frame_pool=None,
+                segment_writer=None, publisher=None):
 
         self.save_audio_files = self.save_video_files = checkpoint_files
+        self.video_frame_pool = video_frame_pool
+        self.stream_video = video_on and checkpoint_files and self.video_container == 'mjpeg'
+
+        # Video segments are encoded in the background so collation never waits on the encoder. A writer pool passed
+        # in may be shared with other processors, so is left for the caller to shut down.
+        owns_segment_writer = segment_writer is None
+        if owns_segment_writer:
+            segment_writer = SegmentWriterPool(workers=1, frame_pool=video_frame_pool, telemetry=self.telemetry)
+
+        self.segment_writer = segment_writer
+
+        # In-process consumers (e.g. detectors) receive finished segments directly from memory
+        self.publisher = publisher
+        self.publish_segments = publisher is not None and publisher.has_subscribers()
+
+        # Queue depths are sampled by the telemetry reporter rather than on every frame
+        if self.telemetry is not None:
+            if audio_on: self.telemetry.watch('audio.queue', audio_frames.__len__)
+            if video_on: self.telemetry.watch('video.queue', video_frames.__len__)
+            if audio_on: self.telemetry.watch('audio.queue_drops', lambda: audio_frames.drops.count)
+            if video_on: self.telemetry.watch('video.queue_drops', lambda: video_frames.drops.count)
+            if video_on: self.telemetry.watch('video.encode_queue', segment_writer.queue_depth)
+
+        # Streams signal the scheduler when a full segment is queued so processing sleeps while there is no work
+        if scheduler is None:
+            scheduler = SegmentScheduler()
+
+        scheduler.register(audio_frames, self.audio_buffer_len_f)
+        scheduler.register(video_frames, self.video_buffer_len_f, streamed=self.stream_video)
+
+        streams_open = lambda: audio_module.stream_open or video_module.stream_open
+        segment_ready = lambda: scheduler.segment_ready(audio_frames) or scheduler.segment_ready(video_frames)
+        frames_to_stream = lambda: self.stream_video and len(video_frames) > 0 and len(self.video_stream_entries) < self.video_buffer_len_f
+        video_segment_ready = lambda: len(self.video_stream_entries if self.stream_video else video_frames) >= self.video_buffer_len_f
 
         if audio_on:
             print(f"         * Segment size           : {self.audio_buffer_len_f}")
@@ -51,108 +110,251 @@ class AudioVisualProcessor():
             print(f"         * Overlap size           : {self.video_overlap_len_f}", end='\n\n')
 
         print(f"\nStart of audio-visual processing", end='\n\n')
+        processing_start_wall = time.monotonic()
+        processing_start_cpu = time.thread_time()
 
-        while (audio_module.stream_open or video_module.stream_open) or \
+        while streams_open() or \
             (len(audio_frames) > self.audio_buffer_len_f) or \
-            (len(video_frames) > self.video_buffer_len_f):
+            (len(video_frames) > self.video_buffer_len_f) or \
+            frames_to_stream():
+
+            # Block until a stream reports a complete segment or a frame to stream (or all streams close)
+            if not scheduler.wait(lambda: segment_ready() or frames_to_stream() or not streams_open()):
+                continue
+
+            if frames_to_stream():
+                self.stream_video_frames(video_frames)
 
             # Audio processing module
             if len(audio_frames) >= self.audio_buffer_len_f:
+                collate_start = time.monotonic()
                 self.collate_audio_frames(audio_frames, audio_channels)
                 self.audio_segment_index += 1
+                if self.telemetry is not None: self.telemetry.observe('audio.collate_time', time.monotonic() - collate_start)
 
             # Video processing module
-            if len(video_frames) >= self.video_buffer_len_f:
+            if video_segment_ready():
+                collate_start = time.monotonic()
                 self.collate_video_frames(video_frames)
                 self.video_segment_index += 1
+                if self.telemetry is not None: self.telemetry.observe('video.collate_time', time.monotonic() - collate_start)
 
-        print(f"\nProcessing module ended.")
+        # A segment still being streamed when capture stopped is closed short, and its frames returned to the pool
+        if self.video_stream_writer is not None: self.close_video_stream()
+        for _, _, slot in self.video_stream_entries:
+            if slot is not None: self.video_frame_pool.release(slot)
+        self.video_stream_entries = []
+
+        # Wait for queued segments to finish encoding and consumers to process published segments
+        if owns_segment_writer: segment_writer.shutdown(wait=True)
+        if publisher is not None: publisher.close(wait=True)
+
+        processing_time_wall = time.monotonic() - processing_start_wall
+        processing_time_cpu = time.thread_time() - processing_start_cpu
+
+        print(f"\n{self.log_prefix}Processing module ended.")
+        print(f"Processing thread CPU time: {processing_time_cpu:.2f}s over {processing_time_wall:.2f}s")
+        if owns_segment_writer: print(segment_writer.summary_line())
+        if hasattr(audio_frames, 'drops'):
+            print(f"Audio chunks dropped (capture queue full, {audio_frames.policy}): {audio_frames.drops.count}")
+        if hasattr(video_frames, 'drops'):
+            print(f"Video frames dropped (capture queue full, {video_frames.policy}): {video_frames.drops.count}")
+        if video_frame_pool is not None:
+            print(f"Video frames dropped (frame pool exhausted): {video_frame_pool.exhausted}")
         print(f"Remaining unprocessed frames: {len(audio_frames)} audio and {len(video_frames)} video \n")
 
     def collate_audio_frames(self, frame_queue, no_channels=1):
-        file_name = ''
-        frame_bytes_buffer = []
-        frame_buffer = np.array([[]] * no_channels)
-        start_timestamp = frame_queue[0][0].strftime('%H:%M:%S.%f')
-        end_timestamp = frame_queue[self.audio_buffer_len_f - 1][0].strftime('%H:%M:%S.%f')
+        # Segment (including overlap into the next segment) is copied out of the capture ring buffer while it is
+        # locked, so the capture thread cannot drop chunks from under the copy, and only written out once unlocked
+        with frame_queue.lock:
+            frame_buffer, timestamps = self.copy_audio_segment(frame_queue)
+
+        result = self.collate_audio_segment(frame_queue, frame_buffer, timestamps)
+
+        print(f" * {self.log_prefix}Audio end time: {result['end_time'].strftime('%H:%M:%S.%f')}")
+
+        return result
 
-        # Add main frames in video segment to buffer
-        for _ in range(self.audio_buffer_len_f - self.audio_overlap_len_f):
-            frame_bytes = frame_queue.popleft()[1]
-            frame_bytes_buffer.append(frame_bytes)
+    def copy_audio_segment(self, frame_queue):
+        # Re-interleave channels into a buffer reused across segments, returned as a (channels, samples) view
+        samples, timestamps = frame_queue.segment(self.audio_buffer_len_f)
+        if self.audio_write_buffer is None or self.audio_write_buffer.shape != samples.T.shape:
+            self.audio_write_buffer = np.empty(samples.T.shape, dtype=np.int16)
 
-        # Add overlap frames to buffer
-        for i in range(self.audio_overlap_len_f):
-            frame_bytes = frame_queue[i][1]
-            frame_bytes_buffer.append(frame_bytes)
+        np.copyto(self.audio_write_buffer, samples.T)
+        timestamps = timestamps.copy()
+
+        # Free main frames of segment for capture, keeping the overlap frames for the start of the next segment
+        frame_queue.consume(self.audio_buffer_len_f - self.audio_overlap_len_f)
+
+        return self.audio_write_buffer.T, timestamps
+
+    def collate_audio_segment(self, frame_queue, frame_buffer, timestamps):
+        file_name = ''
+        start_time = self.clock.to_datetime(timestamps[0])
+        end_time = self.clock.to_datetime(timestamps[-1])
+        start_timestamp = start_time.strftime('%H:%M:%S.%f')
+        end_timestamp = end_time.strftime('%H:%M:%S.%f')
+
+        # Chunks the capture queue dropped up to the end of this segment
+        dropped_ns = frame_queue.drops.drain(timestamps[-1])
 
         # Save audio data to WAV file for checking later
         if self.save_audio_files:
             file_name = f"aud{self.audio_segment_index}_{start_timestamp}_{end_timestamp}.wav"
             wav_file = wave.open(f'{self.audio_save_path}{file_name}', 'wb')
-            wav_file.setnchannels(no_channels)
+            wav_file.setnchannels(frame_queue.channels)
             wav_file.setsampwidth(pyaudio.get_sample_size(pyaudio.paInt16))
             wav_file.setframerate(self.audio_fps)
-            wav_file.writeframes(b''.join(frame_bytes_buffer))
+            wav_file.writeframes(self.audio_write_buffer)
             wav_file.close()
-        else:
-            # Decode all frames from byte representation and arrange into timestamped segment
-            for frame_bytes in frame_bytes_buffer:
-                frame = np.frombuffer(frame_bytes, np.int16)
-
-                # Format stereo and mono channel audio into shape (1, 1024) or (2, 1024)
-                if len(frame) == 2 * self.chunk_size:
-                    channel0 = frame[0::2]
-                    channel1 = frame[1::2]
-                    frame = np.array([channel0, channel1])
-                    frame_buffer = np.append(frame_buffer, frame, axis=1)
-                else:
-                    frame = np.expand_dims(frame, axis=0)
-                    frame_buffer = np.append(frame_buffer, frame, axis=1)
-
-        print(f" * Audio end time: {end_timestamp}")
+
+            self.clock.write_sidecar(
+                f'{self.audio_save_path}{file_name}', timestamps,
+                samples_per_timestamp=frame_queue.chunk_size, dropped_ns=dropped_ns
+            )
+
+        # Consumers run asynchronously, so they are given a copy that the next segment cannot overwrite
+        if self.publish_segments:
+            self.publisher.publish('audio', {
+                'index': self.audio_segment_index,
+                'samples': frame_buffer.copy(),
+                'timestamps': timestamps,
+                'samples_per_timestamp': frame_queue.chunk_size,
+                'dropped_ns': dropped_ns,
+                'sample_rate': self.audio_fps,
+                'start_time': start_time,
+                'end_time': end_time,
+                'file': file_name
+            })
 
         return {
             'buffer': frame_buffer,
-            'file': file_name
+            'file': file_name,
+            'end_time': end_time
         }
 
     def collate_video_frames(self, frame_queue):
         # Setup memory buffer of frames and output video file
         file_name = ''
         frame_buffer = []
-        start_timestamp = frame_queue[0][0].strftime('%H:%M:%S.%f')
-        end_timestamp = frame_queue[self.video_buffer_len_f - 1][0].strftime('%H:%M:%S.%f')
+        segment_slots = []
+        segment_timestamps = np.empty(self.video_buffer_len_f, dtype=np.int64)
 
-        if self.save_video_files:
-            file_name = f"vid{self.video_segment_index}_{start_timestamp}_{end_timestamp}.mp4"
-            output_file = cv2.VideoWriter(
-                f"{self.video_save_path}{file_name}",
-                cv2.VideoWriter_fourcc(*'mp4v'),
-                self.video_fps,
-                self.video_shape
-            )
+        # Main frames are removed from the queue and overlap frames stay queued for the next segment; the segment
+        # owns a reference to every pooled buffer it is given. A streamed segment has already taken its frames off the
+        # queue, and keeps its overlap frames (with a reference of their own) to start the next segment.
+        if self.stream_video:
+            entries = self.video_stream_entries
+            self.video_stream_entries = entries[len(entries) - self.video_overlap_len_f:]
+            for _, _, slot in self.video_stream_entries:
+                if slot is not None: self.video_frame_pool.retain(slot)
+        else:
+            entries = frame_queue.take(self.video_buffer_len_f - self.video_overlap_len_f, self.video_overlap_len_f)
+        start_time = self.clock.to_datetime(entries[0][0])
+        end_time = self.clock.to_datetime(entries[-1][0])
+        start_timestamp = start_time.strftime('%H:%M:%S.%f')
+        end_timestamp = end_time.strftime('%H:%M:%S.%f')
 
-        # Add main frames in video segment to buffer
-        for _ in range(self.video_buffer_len_f - self.video_overlap_len_f):
-            frame = frame_queue.popleft()[1]
-            if self.save_video_files:
-                output_file.write(frame)
-            else:
+        # Frames the capture queue dropped up to the end of this segment
+        dropped_ns = frame_queue.drops.drain(entries[-1][0])
+
+        # Segments kept in memory (no files, or published to consumers) are copied out of the frame pool once
+        keep_in_memory = not self.save_video_files or self.publish_segments
+        if keep_in_memory:
+            frame_shape = entries[0][1].shape
+            segment_frames = np.empty((self.video_buffer_len_f, *frame_shape), dtype=np.uint8)
+
+        for i, (timestamp_ns, frame, slot) in enumerate(entries):
+            segment_timestamps[i] = timestamp_ns
+            if keep_in_memory:
+                segment_frames[i] = frame
+
+            if self.save_video_files and not self.stream_video:
                 frame_buffer.append(frame)
+                if slot is not None: segment_slots.append(slot)
+            elif slot is not None:
+                self.video_frame_pool.release(slot)
 
-        # Add overlap frames to buffer
-        for i in range(self.video_overlap_len_f):
-            frame = frame_queue[i][1]
-            if self.save_video_files:
-                output_file.write(frame)
+        if self.save_video_files:
+            if self.stream_video:
+                file_name = self.close_video_stream()
             else:
-                frame_buffer.append(frame)
+                # Hand segment to the writer pool, which releases pooled frames once encoded
+                file_name = f"vid{self.video_segment_index}_{start_timestamp}_{end_timestamp}.{self.video_container}"
+                self.segment_writer.submit(
+                    f"{self.video_save_path}{file_name}",
+                    frame_buffer,
+                    self.video_fps,
+                    self.video_shape,
+                    slots=segment_slots,
+                    callback=self.video_segment_written,
+                    frame_pool=self.video_frame_pool
+                )
+            self.clock.write_sidecar(f"{self.video_save_path}{file_name}", segment_timestamps, dropped_ns=dropped_ns)
 
-        if self.save_video_files: output_file.release()
-        print(f" * Video end time: {end_timestamp}", end='\n\n')
+        frame_buffer = segment_frames if keep_in_memory else []
+
+        if self.publish_segments:
+            self.publisher.publish('video', {
+                'index': self.video_segment_index,
+                'frames': segment_frames,
+                'timestamps': segment_timestamps,
+                'samples_per_timestamp': 1,
+                'dropped_ns': dropped_ns,
+                'fps': self.video_fps,
+                'start_time': start_time,
+                'end_time': end_time,
+                'file': file_name
+            })
+
+        print(f" * {self.log_prefix}Video end time: {end_timestamp} (encode queue depth: {self.segment_writer.queue_depth()})", end='\n\n')
 
         return {
             'buffer': frame_buffer,
             'file': file_name
         }
+
+    def stream_video_frames(self, frame_queue):
+        # Take the frames queued since the last call off the capture queue and write them to the current indexed
+        # segment, so readers can decode it while it is still being captured. Once taken, frames can no longer be
+        # dropped by the queue, so the segment's index holds exactly the frames of its sidecar. The previous segment's
+        # overlap frames are written again at the start of the next one.
+        missing = self.video_buffer_len_f - len(self.video_stream_entries)
+        self.video_stream_entries.extend(frame_queue.take(min(missing, len(frame_queue))))
+
+        for timestamp_ns, frame, slot in self.video_stream_entries[self.video_streamed:]:
+            try:
+                if self.video_stream_writer is None:
+                    self.open_video_stream(timestamp_ns)
+
+                self.video_stream_writer.write(frame, timestamp_ns)
+            except Exception as e:
+                print(f"Error writing frame {self.video_streamed} of {self.video_stream_file}: {e}")
+            finally:
+                self.video_streamed += 1
+
+    def open_video_stream(self, timestamp_ns):
+        # The segment is named when its first frame arrives, so carries the nominal end time of a full segment (the
+        # exact capture time of every frame is in its index)
+        start_time = self.clock.to_datetime(timestamp_ns)
+        end_time = start_time + datetime.timedelta(seconds=(self.video_buffer_len_f - 1) / self.video_fps)
+
+        self.video_stream_file = f"vid{self.video_segment_index}_{start_time.strftime('%H:%M:%S.%f')}_{end_time.strftime('%H:%M:%S.%f')}.mjpeg"
+        self.video_stream_writer = IndexedSegmentWriter(f"{self.video_save_path}{self.video_stream_file}", expected_frames=self.video_buffer_len_f)
+
+    def close_video_stream(self):
+        # Mark the streamed segment complete, returns its file name
+        file_name = self.video_stream_file
+        if self.video_stream_writer is not None: self.video_stream_writer.close()
+
+        print(f" * {self.log_prefix}Video segment written: {file_name} ({self.video_streamed} frames, streamed)")
+
+        self.video_stream_writer = None
+        self.video_stream_file = ''
+        self.video_streamed = 0
+
+        return file_name
+
+    def video_segment_written(self, result):
+        print(f" * {self.log_prefix}Video segment written: {result['file']} ({result['frames']} frames, {result['encode_time']:.2f}s)")
@@ -1,23 +1,68 @@
 import os
 import cv2
 import time
+import wave
+import queue
+import random
 import pyaudio
 import datetime
+import threading
 import subprocess
+import numpy as np
+import multiprocessing
+from multiprocessing import shared_memory
+
+
+# Proxy renditions match the input format of the detectors (Synchformer: 25 fps, 256 px shortest side, 16 kHz audio)
+PROXY_FPS = 25
+PROXY_SHORT_SIDE = 256
+PROXY_SAMPLE_RATE = 16000
+
+
+def wait_for_replay_time(start_time, index, period_s, speed=1.0, jitter_ms=0):
+    # Sleep until item `index` of a replayed recording is due at `speed` x real time (0 replays as fast as possible),
+    # optionally delivering it late by a random jitter
+    if speed <= 0:
+        return
+
+    due_time = start_time + index * period_s / speed
+    if jitter_ms > 0:
+        due_time += random.uniform(0, jitter_ms / 1000)
+
+    delay = due_time - time.monotonic()
+    if delay > 0:
+        time.sleep(delay)
 
 
 class CombinedCaptureStream():
-    def __init__(self, audio_source=0, video_source=0, checkpoint_path=''):
-        # Check device indices with cmd: `ffmpeg -hide_banner -list_devices true -f avfoundation -i ''`
+    def __init__(self, audio_source=0, video_source=0, checkpoint_path='', backend='videosnap', test_source=False, proxy=False):
+        # Check device indices with cmd: `ffmpeg -hide_banner -list_devices true -f avfoundation -i ''` (VideoSnap, macOS)
+        # or `v4l2-ctl --list-devices` and `arecord -l` (ffmpeg, Linux)
         self.audio_device = audio_source
         self.video_device = video_source
         self.save_path = checkpoint_path
+        self.backend = backend
+        self.test_source = test_source
+
+        # Low resolution proxy of each segment in the detectors' native format, written to `proxy/` (ffmpeg backend)
+        self.proxy = proxy
+        self.proxy_path = os.path.join(checkpoint_path, "proxy/")
+        self.segment_names = {}
+        self.segment_named = threading.Condition()
 
         self.video_width = 1280
         self.video_height = 720
+        self.frame_rate = 25
+        self.sample_rate = 44100
         self.segment_length_s = 10
 
     def launch(self):
+        if self.backend == 'ffmpeg':
+            self.launch_ffmpeg()
+        else:
+            self.launch_videosnap()
+
+    def launch_videosnap(self):
         print("\nCombined audio & video capture stream launched using VideoSnap. \n")
 
         # Format input sources
@@ -32,31 +77,205 @@ class CombinedCaptureStream():
             # Setup stream
             start_timestamp = datetime.datetime.now()
             end_timestamp = start_timestamp + datetime.timedelta(seconds=self.segment_length_s)
-            file_name = f"seg{index}_{start_timestamp.strftime('%H:%M:%S.%f')}_{end_timestamp.strftime('%H:%M:%S.%f')}.mp4"
+            file_name = self.segment_file_name(index, start_timestamp, end_timestamp)
             output_path = os.path.join(self.save_path, file_name)
+            partial_path = os.path.join(self.save_path, f".{file_name}")
             print(f"Opening capture stream #{index} ({start_timestamp.strftime('%H:%M:%S')} -> {end_timestamp.strftime('%H:%M:%S')})")
 
             videosnap_cmd = [
                 'videosnap', '-w', '0',
                 '-t', str(self.segment_length_s),
                 '-p', video_shape,
-                output_path
+                partial_path
             ]
             stream = subprocess.Popen(videosnap_cmd, stdout=logfile, stderr=logfile)
 
+            # Segment is recorded under a hidden name and only appears under its real name once complete
+            threading.Thread(target=self.finish_segment, args=(stream, partial_path, output_path), daemon=True).start()
+
             time.sleep(self.segment_length_s - 1)
             index += 1
 
         logfile.close()
 
+    @staticmethod
+    def finish_segment(stream, partial_path, output_path):
+        if stream.wait() == 0 and os.path.isfile(partial_path):
+            os.replace(partial_path, output_path)
+
+    def launch_ffmpeg(self):
+        print("\nCombined audio & video capture stream launched using ffmpeg. \n")
+
+        # A single ffmpeg process captures continuously and its segment muxer cuts the output on keyframes forced at
+        # every segment boundary, so segments follow on from each other without gaps or double coverage
+        logfile = open(os.path.join(self.save_path, "output-log.txt"), 'a')
+        ffmpeg_cmd = [
+            'ffmpeg', '-hide_banner', '-nostdin',
+            *self.ffmpeg_inputs(),
+            '-map', '0:v', '-map', '1:a',
+            '-c:v', 'libx264', '-preset', 'veryfast', '-pix_fmt', 'yuv420p',
+            '-force_key_frames', f'expr:gte(t,n_forced*{self.segment_length_s})',
+            '-c:a', 'aac',
+            '-f', 'segment', '-segment_time', str(self.segment_length_s), '-segment_format', 'mp4',
+            '-reset_timestamps', '1',
+            '-segment_list', 'pipe:1', '-segment_list_type', 'csv',
+            os.path.join(self.save_path, '.capture%d.mp4')
+        ]
+
+        # The proxy is a second output of the same process, cut at the same forced keyframes as the full segments
+        if self.proxy:
+            os.makedirs(self.proxy_path, exist_ok=True)
+            proxy_list_path = os.path.join(self.proxy_path, '.segments.csv')
+            short_side = PROXY_SHORT_SIDE
+            ffmpeg_cmd += [
+                '-map', '0:v', '-map', '1:a',
+                '-vf', f"fps={PROXY_FPS},scale='if(gt(iw,ih),-2,{short_side})':'if(gt(iw,ih),{short_side},-2)'",
+                '-c:v', 'libx264', '-preset', 'veryfast', '-pix_fmt', 'yuv420p',
+                '-force_key_frames', f'expr:gte(t,n_forced*{self.segment_length_s})',
+                '-c:a', 'aac', '-ar', str(PROXY_SAMPLE_RATE),
+                '-f', 'segment', '-segment_time', str(self.segment_length_s), '-segment_format', 'mp4',
+                '-reset_timestamps', '1',
+                '-segment_list', proxy_list_path, '-segment_list_type', 'csv',
+                os.path.join(self.proxy_path, '.capture%d.mp4')
+            ]
+
+        launch_timestamp = datetime.datetime.now()
+        stream = subprocess.Popen(ffmpeg_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+
+        if self.proxy:
+            proxy_thread = threading.Thread(target=self.finish_proxy_segments, args=(stream, proxy_list_path), daemon=True)
+            proxy_thread.start()
+
+        # Segment times are listed relative to the start of capture, which ffmpeg reports (as wall clock time) on stderr
+        capture_start = {}
+        start_reported = threading.Event()
+        log_thread = threading.Thread(target=self.log_ffmpeg_output, args=(stream.stderr, logfile, capture_start, start_reported), daemon=True)
+        log_thread.start()
+
+        index = 0
+        # Each finished segment is listed as `file,start,end` once ffmpeg has closed it, and only then is it renamed
+        # from its hidden name so detectors never pick up a partly written segment
+        for line in stream.stdout:
+            try:
+                file_name, start_s, end_s = line.strip().rsplit(',', 2)
+            except ValueError:
+                continue
+
+            start_reported.wait(timeout=1)
+            reference = capture_start.get('start', launch_timestamp)
+            start_timestamp = reference + datetime.timedelta(seconds=float(start_s))
+            end_timestamp = reference + datetime.timedelta(seconds=float(end_s))
+
+            file_name = os.path.basename(file_name.strip('"'))
+            segment_name = self.segment_file_name(index, start_timestamp, end_timestamp)
+            os.rename(os.path.join(self.save_path, file_name), os.path.join(self.save_path, segment_name))
+            print(f"Captured segment #{index} ({start_timestamp.strftime('%H:%M:%S.%f')} -> {end_timestamp.strftime('%H:%M:%S.%f')})")
+
+            with self.segment_named:
+                self.segment_names[index] = segment_name
+                self.segment_named.notify_all()
+
+            index += 1
+
+        stream.wait()
+        with self.segment_named:
+            self.segment_named.notify_all()
+
+        if self.proxy: proxy_thread.join(timeout=5)
+        log_thread.join(timeout=1)
+        logfile.close()
+        print(f"ffmpeg capture ended (exit code {stream.returncode}).")
+
+    def finish_proxy_segments(self, stream, list_path):
+        # Follow the proxy output's segment list, giving each finished proxy the name of the full segment it matches
+        while not os.path.isfile(list_path):
+            if stream.poll() is not None:
+                return
+            time.sleep(0.1)
+
+        index = 0
+        entry = ''
+        with open(list_path, 'r') as segment_list:
+            while True:
+                entry += segment_list.readline()
+                if not entry.endswith('\n'):
+                    if stream.poll() is not None:
+                        break
+                    time.sleep(0.1)
+                    continue
+
+                file_name = os.path.basename(entry.strip().rsplit(',', 2)[0].strip('"'))
+                entry = ''
+
+                with self.segment_named:
+                    self.segment_named.wait_for(lambda: index in self.segment_names or stream.poll() is not None)
+                    segment_name = self.segment_names.get(index)
+
+                if segment_name is None:
+                    break
+
+                os.replace(os.path.join(self.proxy_path, file_name), os.path.join(self.proxy_path, segment_name))
+                index += 1
+
+    def ffmpeg_inputs(self):
+        # Video input first (its start time is the reference for segment times), then audio
+        video_shape = f'{self.video_width}x{self.video_height}'
+
+        # Synthetic lavfi sources (read at native rate) to run the capture pipeline without devices
+        if self.test_source:
+            return [
+                '-re', '-f', 'lavfi', '-i', f'testsrc=size={video_shape}:rate={self.frame_rate}',
+                '-re', '-f', 'lavfi', '-i', f'sine=frequency=1000:sample_rate={self.sample_rate}'
+            ]
+
+        video_device = f'/dev/video{self.video_device}' if isinstance(self.video_device, int) else self.video_device
+        audio_device = f'hw:{self.audio_device}' if isinstance(self.audio_device, int) else self.audio_device
+        return [
+            '-f', 'v4l2', '-thread_queue_size', '512', '-use_wallclock_as_timestamps', '1',
+            '-framerate', str(self.frame_rate), '-video_size', video_shape, '-i', video_device,
+            '-f', 'alsa', '-thread_queue_size', '512', '-use_wallclock_as_timestamps', '1',
+            '-sample_rate', str(self.sample_rate), '-i', audio_device
+        ]
+
+    @staticmethod
+    def log_ffmpeg_output(output, logfile, capture_start, start_reported):
+        # Copy ffmpeg's log to file, picking out the start time of the first input (e.g. `Duration: N/A, start: 1697551234.123456`)
+        for line in output:
+            logfile.write(line)
+            logfile.flush()
+
+            if not start_reported.is_set() and 'start: ' in line:
+                start_s = line.split('start: ', 1)[1].split(',', 1)[0]
+                try:
+                    start_s = float(start_s)
+                    # Wall clock timestamps (device inputs) give the time directly, relative ones (test sources) are from launch
+                    if start_s > 1e9:
+                        capture_start['start'] = datetime.datetime.fromtimestamp(start_s)
+                except ValueError:
+                    pass
+                start_reported.set()
+
+    @staticmethod
+    def segment_file_name(index, start_timestamp, end_timestamp):
+        return f"seg{index}_{start_timestamp.strftime('%H:%M:%S.%f')}_{end_timestamp.strftime('%H:%M:%S.%f')}.mp4"
+
 
 class AudioStream():
-    def __init__(self, device=1, sample_rate=44100, audio_channels=1):
+    def __init__(self, device=1, sample_rate=44100, audio_channels=1, callback_mode=False, telemetry=None):
         self.format = pyaudio.paInt16
         self.rate = sample_rate
         self.chunk = 1024
         self.stream = None
         self.stream_open = False
+        self.scheduler = None
+        self.telemetry = telemetry
+
+        # Callback mode has PortAudio hand each chunk to `on_chunk` from its own thread instead of a blocking read loop
+        self.callback_mode = callback_mode
+        self.frame_queue = None
+        self.chunk_duration_ns = round(self.chunk * 1e9 / self.rate)
+        self.input_overflows = 0
+        self.closed = threading.Event()
 
         self.audio_device = device
         self.audio = pyaudio.PyAudio()
@@ -66,35 +285,67 @@ class AudioStream():
         print(f"     * Audio:")
         print(f"         * Capture device         : {self.audio_device}")
         print(f"         * Input channels         : {self.audio_channels}")
+        print(f"         * Capture mode           : {'callback' if callback_mode else 'blocking read'}")
 
-    def launch(self, frame_queue):
+    def launch(self, frame_queue, scheduler=None):
         # Start audio recording
         self.stream_open = True
+        self.scheduler = scheduler
+        self.frame_queue = frame_queue
+        telemetry = self.telemetry
+        if telemetry is not None: telemetry.set_nominal_rate('audio.chunks', self.rate / self.chunk)
+
         stream = self.audio.open(
             format=self.format, rate=self.rate, input=True,
             input_device_index=self.audio_device, channels=self.audio_channels,
-            frames_per_buffer=self.chunk
+            frames_per_buffer=self.chunk, stream_callback=self.on_chunk if self.callback_mode else None
         )
 
-        while self.stream_open:
-            frame = stream.read(self.chunk)
-            timestamp = datetime.datetime.now()
-
-            frame_queue.append((timestamp, frame))
-            print(f"Timestamp counter: {timestamp.strftime('%H:%M:%S.%f')}", end='\r')
+        if self.callback_mode:
+            # Nothing to do on this thread until the stream is stopped
+            while self.stream_open and stream.is_active():
+                self.closed.wait(timeout=1)
+        else:
+            while self.stream_open:
+                frame = stream.read(self.chunk)
+                self.queue_chunk(frame)
 
         stream.stop_stream()
         stream.close()
         self.audio.terminate()
-        print("Audio thread ended.")
+        print(f"Audio thread ended ({self.input_overflows} input overflows).")
+
+    def on_chunk(self, in_data, frame_count, time_info, status_flags):
+        # Runs on the PortAudio callback thread so does as little as possible: chunks are copied straight into the
+        # preallocated ring buffer (never waiting for space) and overflows reported by the device are counted
+        if status_flags & pyaudio.paInputOverflow:
+            self.input_overflows += 1
+            if self.telemetry is not None: self.telemetry.increment('audio.input_overflows')
+
+        self.queue_chunk(in_data, block=False)
+
+        return None, pyaudio.paContinue if self.stream_open else pyaudio.paComplete
+
+    def queue_chunk(self, frame, block=True):
+        # Chunks are stamped with the monotonic time of their first sample (delivered once the chunk is complete)
+        timestamp_ns = time.monotonic_ns() - self.chunk_duration_ns
+
+        written = self.frame_queue.write(frame, timestamp_ns, block=block)
+        if self.scheduler is not None: self.scheduler.notify(self.frame_queue)
+
+        if self.telemetry is not None:
+            self.telemetry.increment('audio.chunks')
+            if not written: self.telemetry.increment('audio.dropped')
 
     def kill(self):
         self.stream_open = False
+        self.closed.set()
+        if self.scheduler is not None: self.scheduler.notify()
         print("Microphone turned off.")
 
 
 class VideoStream():
-    def __init__(self, device=0, aspect_ratio_x=1280, aspect_ratio_y=720):
+    def __init__(self, device=0, aspect_ratio_x=1280, aspect_ratio_y=720, telemetry=None):
         # Define a video capture object
         self.video_device = device
         self.video_stream = cv2.VideoCapture(self.video_device)
@@ -104,12 +355,15 @@ class VideoStream():
 
         self.frame_rate = self.video_stream.get(cv2.CAP_PROP_FPS)
         self.stream_open = False
+        self.scheduler = None
+        self.telemetry = telemetry
 
         self.width = aspect_ratio_x
         self.height = aspect_ratio_y
 
-    def launch(self, frame_queue=None, display_stream=False):
+    def launch(self, frame_queue=None, display_stream=False, scheduler=None, frame_pool=None):
         self.stream_open = True
+        self.scheduler = scheduler
         # Show the video stream (no processing)
         if display_stream:
             while self.video_stream.isOpened():
@@ -129,17 +383,333 @@ class VideoStream():
             self.video_stream.read()
             self.video_stream.read()
 
+            telemetry = self.telemetry
+            if telemetry is not None: telemetry.set_nominal_rate('video.frames', self.frame_rate)
+
             while self.stream_open:
                 # Capture the video frame by frame
-                _, frame = self.video_stream.read()
-                timestamp = datetime.datetime.now()
-                frame_queue.append((timestamp, frame))
-                print(f"Timestamp counter: {timestamp.strftime('%H:%M:%S.%f')}", end='\r')
+                if frame_pool is None:
+                    success, timestamp_ns, frame = self.read_frame()
+                    slot = None
+                else:
+                    slot = frame_pool.acquire()
+
+                    # All pool buffers in use: drop this frame rather than allocate more memory
+                    if slot is None:
+                        self.video_stream.grab()
+                        frame_queue.mark_gap(time.monotonic_ns())
+                        frame_pool.mark_exhausted()
+                        if telemetry is not None: telemetry.increment('video.dropped')
+                        continue
+
+                    success, timestamp_ns, frame = self.read_frame(frame_pool.frames[slot])
+
+                if not success:
+                    if slot is not None: frame_pool.release(slot)
+                    if telemetry is not None: telemetry.increment('video.read_failures')
+                    continue
+
+                queued = frame_queue.append((timestamp_ns, frame, slot))
+                if scheduler is not None: scheduler.notify(frame_queue)
+
+                if telemetry is not None:
+                    telemetry.increment('video.frames')
+                    if not queued: telemetry.increment('video.dropped')
 
         self.video_stream.release()
         cv2.destroyAllWindows()
         print("\nVideo thread ended.")
 
+    def read_frame(self, buffer=None):
+        # Stamp when the frame is grabbed from the device, then decode it (directly into a pooled buffer if given,
+        # resizing if the device ignored the requested resolution)
+        success = self.video_stream.grab()
+        timestamp_ns = time.monotonic_ns()
+        frame = None
+
+        if success and buffer is None:
+            success, frame = self.video_stream.retrieve()
+        elif success:
+            success, frame = self.video_stream.retrieve(buffer)
+            if success and frame is not buffer:
+                cv2.resize(frame, (self.width, self.height), dst=buffer)
+                frame = buffer
+
+        return success, timestamp_ns, frame
+
+    def kill(self):
+        self.stream_open = False
+        if self.scheduler is not None: self.scheduler.notify()
+        print("Camera turned off.")
+
+
+class ProcessVideoStream():
+    def __init__(self, device=0, aspect_ratio_x=1280, aspect_ratio_y=720, prefetch_slots=8, telemetry=None, start_timeout_s=30):
+        # The camera is read by a separate process (with its own interpreter) that decodes frames into a shared memory
+        # frame pool, so capture cadence is unaffected by collation, encoding or detection in this process
+        self.video_device = device
+        self.width = aspect_ratio_x
+        self.height = aspect_ratio_y
+        self.prefetch_slots = prefetch_slots
+        self.stream_open = False
+        self.scheduler = None
+        self.telemetry = telemetry
+
+        # Free pool slots are sent to the capture process, which returns (slot, capture time) for each frame read
+        self.free_slots = multiprocessing.Queue()
+        self.captured = multiprocessing.Queue()
+        self.stop_event = multiprocessing.Event()
+        self.process = multiprocessing.Process(
+            target=run_video_capture_process,
+            args=(device, aspect_ratio_x, aspect_ratio_y, self.free_slots, self.captured, self.stop_event),
+            daemon=True
+        )
+        self.process.start()
+
+        # Capture process reports the device frame rate once the camera is open, but may exit (or hang) opening it
+        start_deadline = time.monotonic() + start_timeout_s
+        while True:
+            try:
+                _, self.frame_rate = self.captured.get(timeout=1)
+                break
+            except queue.Empty:
+                if not self.process.is_alive():
+                    raise RuntimeError(f"Video capture process for device {device} exited (code {self.process.exitcode}) before opening the camera")
+                if time.monotonic() > start_deadline:
+                    self.process.terminate()
+                    raise RuntimeError(f"Video capture process for device {device} did not open the camera within {start_timeout_s}s")
+
+    def launch(self, frame_queue=None, display_stream=False, scheduler=None, frame_pool=None):
+        # `frame_pool` must be a SharedVideoFramePool, as frames are only ever passed between processes by slot
+        self.stream_open = True
+        self.scheduler = scheduler
+        telemetry = self.telemetry
+        if telemetry is not None: telemetry.set_nominal_rate('video.frames', self.frame_rate)
+
+        self.free_slots.put(('pool', frame_pool.name, frame_pool.frames.shape))
+        outstanding = 0
+
+        while self.stream_open:
+            # Keep the capture process supplied with free buffers to decode into
+            while outstanding < self.prefetch_slots:
+                slot = frame_pool.acquire()
+                if slot is None:
+                    break
+
+                self.free_slots.put(slot)
+                outstanding += 1
+
+            try:
+                slot, timestamp_ns = self.captured.get(timeout=1)
+            except queue.Empty:
+                # A capture process that has died will send no more frames, so the stream is closed
+                if not self.process.is_alive():
+                    print(f"\nVideo capture process for device {self.video_device} exited (code {self.process.exitcode})")
+                    self.kill()
+                continue
+
+            # No free buffer in the capture process when this frame arrived, so it was dropped there
+            if slot is None:
+                frame_queue.mark_gap(timestamp_ns)
+                frame_pool.mark_exhausted()
+                if telemetry is not None: telemetry.increment('video.dropped')
+                continue
+
+            outstanding -= 1
+            if timestamp_ns is None:
+                frame_pool.release(slot)
+                if telemetry is not None: telemetry.increment('video.read_failures')
+                continue
+
+            queued = frame_queue.append((timestamp_ns, frame_pool.frames[slot], slot))
+            if scheduler is not None: scheduler.notify(frame_queue)
+
+            if telemetry is not None:
+                telemetry.increment('video.frames')
+                if not queued: telemetry.increment('video.dropped')
+
+        self.stop_event.set()
+        self.process.join(timeout=5)
+        print("\nVideo capture process ended.")
+
     def kill(self):
         self.stream_open = False
+        if self.scheduler is not None: self.scheduler.notify()
         print("Camera turned off.")
+
+
+def run_video_capture_process(device, width, height, free_slots, captured, stop_event):
+    # Capture process of a ProcessVideoStream: reads frames into the shared frame pool slots it is given
+    video = VideoStream(device=device, aspect_ratio_x=width, aspect_ratio_y=height)
+    captured.put(('info', video.frame_rate))
+
+    _, pool_name, pool_shape = free_slots.get()
+    pool_memory = shared_memory.SharedMemory(name=pool_name)
+    frames = np.ndarray(pool_shape, dtype=np.uint8, buffer=pool_memory.buf)
+
+    # Flush initial two black frames
+    video.video_stream.read()
+    video.video_stream.read()
+
+    while not stop_event.is_set():
+        try:
+            slot = free_slots.get_nowait()
+        except queue.Empty:
+            # Every buffer is still in use by the processor: skip the frame but report when it was captured
+            video.video_stream.grab()
+            captured.put((None, time.monotonic_ns()))
+            continue
+
+        success, timestamp_ns, _ = video.read_frame(frames[slot])
+        captured.put((slot, timestamp_ns if success else None))
+
+    video.video_stream.release()
+    del frames
+    pool_memory.close()
+
+
+class FileAudioStream():
+    def __init__(self, path, speed=1.0, jitter_ms=0, drop_rate=0, loop=False, telemetry=None):
+        # Replays a 16-bit WAV recording through the same interface as a microphone AudioStream
+        self.wav_file = wave.open(path, 'rb')
+        if self.wav_file.getsampwidth() != 2:
+            raise ValueError(f"Replayed audio must be 16-bit PCM: {path}")
+
+        self.rate = self.wav_file.getframerate()
+        self.chunk = 1024
+        self.audio_channels = self.wav_file.getnchannels()
+        self.audio_device = path
+        self.stream_open = False
+        self.scheduler = None
+        self.telemetry = telemetry
+
+        self.speed = speed
+        self.jitter_ms = jitter_ms
+        self.drop_rate = drop_rate
+        self.loop = loop
+
+        print(f"     * Audio:")
+        print(f"         * Replayed file          : {self.audio_device} ({speed}x)")
+        print(f"         * Input channels         : {self.audio_channels}")
+
+    def launch(self, frame_queue, scheduler=None):
+        self.stream_open = True
+        self.scheduler = scheduler
+        telemetry = self.telemetry
+        if telemetry is not None: telemetry.set_nominal_rate('audio.chunks', self.speed * self.rate / self.chunk)
+
+        # Chunks are stamped with the time of their first sample on the replay clock, as for a live device
+        chunk_period_s = self.chunk / self.rate
+        chunk_duration_ns = round(chunk_period_s * 1e9 / self.speed) if self.speed > 0 else 0
+        chunk_bytes = self.chunk * self.audio_channels * 2
+        replay_start = time.monotonic()
+        index = 0
+
+        while self.stream_open:
+            frame = self.wav_file.readframes(self.chunk)
+
+            # End of recording: restart or close the stream so processing can flush the remaining segments
+            if len(frame) == 0:
+                if self.loop:
+                    self.wav_file.rewind()
+                    continue
+                break
+
+            if len(frame) < chunk_bytes:
+                frame = frame + bytes(chunk_bytes - len(frame))
+
+            wait_for_replay_time(replay_start, index + 1, chunk_period_s, self.speed, self.jitter_ms)
+            index += 1
+
+            # Injected drop: chunk is consumed from the recording but never delivered
+            if self.drop_rate > 0 and random.random() < self.drop_rate:
+                if telemetry is not None: telemetry.increment('audio.injected_drops')
+                continue
+
+            timestamp_ns = time.monotonic_ns() - chunk_duration_ns
+            written = frame_queue.write(frame, timestamp_ns)
+            if scheduler is not None: scheduler.notify(frame_queue)
+
+            if telemetry is not None:
+                telemetry.increment('audio.chunks')
+                if not written: telemetry.increment('audio.dropped')
+
+        self.wav_file.close()
+        self.kill()
+        print("Audio replay ended.")
+
+    def kill(self):
+        self.stream_open = False
+        if self.scheduler is not None: self.scheduler.notify()
+
+
+class FileVideoStream(VideoStream):
+    def __init__(self, path, speed=1.0, jitter_ms=0, drop_rate=0, loop=False, telemetry=None):
+        # Replays a video recording through the same interface as a camera VideoStream
+        super().__init__(device=path, telemetry=telemetry)
+
+        self.width = int(self.video_stream.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(self.video_stream.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+        self.speed = speed
+        self.jitter_ms = jitter_ms
+        self.drop_rate = drop_rate
+        self.loop = loop
+
+    def launch(self, frame_queue=None, display_stream=False, scheduler=None, frame_pool=None):
+        self.stream_open = True
+        self.scheduler = scheduler
+        telemetry = self.telemetry
+        if telemetry is not None: telemetry.set_nominal_rate('video.frames', self.speed * self.frame_rate)
+
+        frame_period_s = 1 / self.frame_rate
+        replay_start = time.monotonic()
+        index = 0
+
+        while self.stream_open:
+            wait_for_replay_time(replay_start, index, frame_period_s, self.speed, self.jitter_ms)
+            index += 1
+
+            slot = None
+            if frame_pool is not None:
+                slot = frame_pool.acquire()
+
+                # All pool buffers in use: drop this frame rather than allocate more memory
+                if slot is None:
+                    success = self.video_stream.grab()
+                    if success:
+                        frame_queue.mark_gap(time.monotonic_ns())
+                        frame_pool.mark_exhausted()
+                        if telemetry is not None: telemetry.increment('video.dropped')
+                        continue
+
+            success, timestamp_ns, frame = self.read_frame(frame_pool.frames[slot] if slot is not None else None)
+
+            # End of recording: restart or close the stream so processing can flush the remaining segments
+            if not success:
+                if slot is not None: frame_pool.release(slot)
+                if self.loop:
+                    self.video_stream.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    continue
+                break
+
+            # Injected drop: frame is consumed from the recording but never delivered
+            if self.drop_rate > 0 and random.random() < self.drop_rate:
+                if slot is not None: frame_pool.release(slot)
+                if telemetry is not None: telemetry.increment('video.injected_drops')
+                continue
+
+            queued = frame_queue.append((timestamp_ns, frame, slot))
+            if scheduler is not None: scheduler.notify(frame_queue)
+
+            if telemetry is not None:
+                telemetry.increment('video.frames')
+                if not queued: telemetry.increment('video.dropped')
+
+        self.video_stream.release()
+        self.kill()
+        print("\nVideo replay ended.")
+
+    def kill(self):
+        self.stream_open = False
+        if self.scheduler is not None: self.scheduler.notify()
@@ -0,0 +1,32 @@
+import time
+import datetime
+import numpy as np
+
+
+class CaptureClock():
+    def __init__(self):
+        # Single wall clock reference so monotonic capture times can be labelled without being affected by NTP jumps
+        self.reference_wall_ns = time.time_ns()
+        self.reference_monotonic_ns = time.monotonic_ns()
+
+    @staticmethod
+    def now():
+        return time.monotonic_ns()
+
+    def to_datetime(self, monotonic_ns):
+        wall_ns = self.reference_wall_ns + int(monotonic_ns) - self.reference_monotonic_ns
+        return datetime.datetime.fromtimestamp(wall_ns / 1e9)
+
+    def write_sidecar(self, segment_path, capture_ns, samples_per_timestamp=1, dropped_ns=()):
+        # Capture times of each frame (or audio chunk) stored next to the segment as `<segment>.timestamps.npz`,
+        # along with the capture times of any frames dropped by the capture queues
+        sidecar_path = f"{segment_path.rsplit('.', 1)[0]}.timestamps.npz"
+        np.savez(
+            sidecar_path,
+            capture_ns=np.asarray(capture_ns, dtype=np.int64),
+            samples_per_timestamp=samples_per_timestamp,
+            dropped_ns=np.asarray(dropped_ns, dtype=np.int64),
+            wall_reference_ns=np.array([self.reference_wall_ns, self.reference_monotonic_ns], dtype=np.int64)
+        )
+
+        return sidecar_path
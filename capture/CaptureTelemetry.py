@@ -0,0 +1,169 @@
+import json
+import math
+import time
+import threading
+from collections import defaultdict
+
+
+class Histogram():
+    def __init__(self, resolution_s=1e-6, buckets=32):
+        # Power-of-two buckets from `resolution_s` upwards (bucket i holds values below resolution_s * 2^i)
+        self.resolution_s = resolution_s
+        self.counts = [0] * buckets
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def record(self, value):
+        bucket = math.frexp(value / self.resolution_s)[1] if value > 0 else 0
+        self.counts[min(max(bucket, 0), len(self.counts) - 1)] += 1
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def percentile(self, percent):
+        # Upper bound of the bucket containing the requested percentile
+        threshold = self.count * percent / 100
+        cumulative = 0
+        for bucket, count in enumerate(self.counts):
+            cumulative += count
+            if count > 0 and cumulative >= threshold:
+                return min(self.resolution_s * 2 ** bucket, self.max)
+
+        return 0.0
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count > 0 else 0.0,
+            'min': self.min if self.count > 0 else 0.0,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95)
+        }
+
+
+class CaptureTelemetry():
+    def __init__(self, summary_interval_s=10, json_path=None):
+        # Counters are updated without locking from the thread that owns them (single writer per counter)
+        self.counters = defaultdict(int)
+        self.histograms = defaultdict(Histogram)
+        self.nominal_rates = {}
+        self.watchers = {}
+
+        self.summary_interval_s = summary_interval_s
+        self.json_path = json_path
+        self.start_time = time.monotonic()
+        self.last_report_time = self.start_time
+        self.last_report_counters = {}
+        self.effective_rates = {}
+
+        self.reporter = None
+        self.running = False
+
+    def increment(self, name, value=1):
+        self.counters[name] += value
+
+    def observe(self, name, seconds):
+        self.histograms[name].record(seconds)
+
+    def set_nominal_rate(self, name, rate):
+        # Expected rate (per second) of counter `name`, to compare against the measured rate
+        self.nominal_rates[name] = rate
+
+    def watch(self, name, function):
+        # Gauges (e.g. queue lengths) are only sampled when a summary is produced, adding no cost to the capture path
+        self.watchers[name] = function
+
+    def scope(self, prefix):
+        # View of this telemetry that prefixes metric names, so several capture rigs can share one reporter
+        return TelemetryScope(self, prefix)
+
+    def snapshot(self):
+        now = time.monotonic()
+        interval = max(now - self.last_report_time, 1e-9)
+        counters = dict(self.counters)
+
+        for name, nominal_rate in self.nominal_rates.items():
+            previous = self.last_report_counters.get(name, 0)
+            self.effective_rates[name] = {
+                'effective': (counters.get(name, 0) - previous) / interval,
+                'nominal': nominal_rate
+            }
+
+        self.last_report_time = now
+        self.last_report_counters = counters
+
+        return {
+            'uptime_s': now - self.start_time,
+            'counters': counters,
+            'rates': dict(self.effective_rates),
+            'gauges': {name: function() for name, function in self.watchers.items()},
+            'histograms': {name: histogram.summary() for name, histogram in list(self.histograms.items())}
+        }
+
+    def summary_line(self, snapshot):
+        parts = []
+        for name, rate in snapshot['rates'].items():
+            parts.append(f"{name} {rate['effective']:.1f}/{rate['nominal']:.1f}/s")
+        for name, count in snapshot['counters'].items():
+            if name not in snapshot['rates']:
+                parts.append(f"{name} {count}")
+        for name, value in snapshot['gauges'].items():
+            parts.append(f"{name} {value}")
+        for name, histogram in snapshot['histograms'].items():
+            parts.append(f"{name} {histogram['mean'] * 1000:.1f}ms (p95 {histogram['p95'] * 1000:.1f}ms)")
+
+        return f"[telemetry {snapshot['uptime_s']:.0f}s] " + " | ".join(parts)
+
+    def report(self):
+        snapshot = self.snapshot()
+        print(self.summary_line(snapshot))
+
+        if self.json_path is not None:
+            self.export_json(self.json_path, snapshot)
+
+        return snapshot
+
+    def export_json(self, path, snapshot=None):
+        if snapshot is None:
+            snapshot = self.snapshot()
+
+        with open(path, 'w') as file:
+            json.dump(snapshot, file, indent=2)
+
+    def start(self):
+        # Periodic summary from a background thread instead of printing on every frame
+        self.running = True
+        self.reporter = threading.Thread(target=self.run_reporter, daemon=True)
+        self.reporter.start()
+
+    def run_reporter(self):
+        while self.running:
+            time.sleep(self.summary_interval_s)
+            if self.running:
+                self.report()
+
+    def stop(self):
+        self.running = False
+        self.report()
+
+
+class TelemetryScope():
+    def __init__(self, telemetry, prefix):
+        self.telemetry = telemetry
+        self.prefix = prefix
+
+    def increment(self, name, value=1):
+        self.telemetry.increment(f"{self.prefix}.{name}", value)
+
+    def observe(self, name, seconds):
+        self.telemetry.observe(f"{self.prefix}.{name}", seconds)
+
+    def set_nominal_rate(self, name, rate):
+        self.telemetry.set_nominal_rate(f"{self.prefix}.{name}", rate)
+
+    def watch(self, name, function):
+        self.telemetry.watch(f"{self.prefix}.{name}", function)
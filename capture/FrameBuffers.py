@@ -0,0 +1,263 @@
+import math
+import threading
+import numpy as np
+from collections import deque
+from multiprocessing import shared_memory
+
+
+# Behaviour of capture queues once full: wait for the processor to free space (falling back to dropping the
+# incoming frame after a timeout), discard the oldest queued frame, or discard the incoming frame
+QUEUE_POLICIES = ('block', 'drop-oldest', 'drop-newest')
+
+
+class DropLog():
+    def __init__(self):
+        # Capture times (ns) of frames/chunks discarded by a capture queue, so gaps caused by the capture side
+        # can be told apart from stutter in the device output
+        self.dropped = deque()
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def record(self, timestamp_ns):
+        with self.lock:
+            self.dropped.append(timestamp_ns)
+            self.count += 1
+
+    def drain(self, until_ns):
+        # Remove and return the drops captured up to `until_ns` (the end of the segment being collated)
+        drained = []
+        with self.lock:
+            while len(self.dropped) > 0 and self.dropped[0] <= until_ns:
+                drained.append(self.dropped.popleft())
+
+        return np.array(drained, dtype=np.int64)
+
+
+class AudioRingBuffer():
+    def __init__(self, capacity_s=60, sample_rate=44100, chunk_size=1024, channels=1, policy='drop-newest', block_timeout_s=1.0):
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(f"Unknown capture queue policy '{policy}', expected one of {QUEUE_POLICIES}")
+
+        self.chunk_size = chunk_size
+        self.channels = channels
+        self.capacity = math.ceil(sample_rate * capacity_s / chunk_size)
+
+        # Chunks are written twice (slot and slot + capacity) so that any window of up to `capacity` chunks
+        # starting inside the ring is one contiguous region and can be returned as a view without copying
+        self.samples = np.zeros((channels, 2 * self.capacity * chunk_size), dtype=np.int16)
+        self.timestamps = np.zeros(2 * self.capacity, dtype=np.int64)
+
+        # Absolute chunk counters, only ever incremented (write by capture thread, read by processor)
+        self.write_index = 0
+        self.read_index = 0
+        self.overruns = 0
+
+        # The processor holds `lock` while it reads a segment so chunks are never dropped from under its views
+        self.policy = policy
+        self.block_timeout_s = block_timeout_s
+        self.drops = DropLog()
+        self.lock = threading.RLock()
+        self.space = threading.Condition(self.lock)
+
+    def __len__(self):
+        return self.write_index - self.read_index
+
+    def write(self, frame_bytes, timestamp_ns, block=True):
+        # Writers that must not wait (e.g. audio callbacks) pass `block=False`, dropping the chunk if the ring is full
+        if len(self) >= self.capacity and not self.make_space(block):
+            self.overruns += 1
+            self.drops.record(timestamp_ns)
+            return False
+
+        # Interleaved int16 bytes from the device, de-interleaved straight into the ring as (channels, samples)
+        chunk = np.frombuffer(frame_bytes, dtype=np.int16).reshape(-1, self.channels).T
+        slot = self.write_index % self.capacity
+
+        for offset in (slot, slot + self.capacity):
+            self.samples[:, offset * self.chunk_size:(offset + 1) * self.chunk_size] = chunk
+            self.timestamps[offset] = timestamp_ns
+
+        self.write_index += 1
+        return True
+
+    def make_space(self, block=True):
+        # Apply the queue policy when the ring is full, returns whether the incoming chunk can now be written. Writers
+        # that must not wait never queue for the lock: the read position only moves forward, so without dropping the
+        # oldest chunk the ring is read unlocked, and the oldest chunk is only dropped if the processor is not reading.
+        if not block:
+            if self.policy != 'drop-oldest':
+                return len(self) < self.capacity
+
+            if not self.lock.acquire(blocking=False):
+                return False
+
+            try:
+                return self.drop_oldest()
+            finally:
+                self.lock.release()
+
+        with self.space:
+            if self.policy == 'block':
+                self.space.wait_for(lambda: len(self) < self.capacity, timeout=self.block_timeout_s)
+            elif self.policy == 'drop-oldest':
+                return self.drop_oldest()
+
+            return len(self) < self.capacity
+
+    def drop_oldest(self):
+        # Called with the lock held
+        if len(self) >= self.capacity:
+            self.drops.record(int(self.timestamps[self.read_index % self.capacity]))
+            self.overruns += 1
+            self.read_index += 1
+
+        return len(self) < self.capacity
+
+    def timestamp(self, index):
+        # Monotonic capture time (ns) of the first sample of the chunk `index` places from the read position
+        return int(self.timestamps[(self.read_index + index) % self.capacity])
+
+    def segment(self, length):
+        # Zero-copy views of the next `length` chunks (samples and timestamps) without consuming them
+        if length > len(self):
+            raise IndexError(f"Requested {length} chunks but only {len(self)} are buffered")
+
+        start = self.read_index % self.capacity
+        samples = self.samples[:, start * self.chunk_size:(start + length) * self.chunk_size]
+        timestamps = self.timestamps[start:start + length]
+
+        return samples, timestamps
+
+    def consume(self, length):
+        # Release chunks back to the capture thread; views returned by `segment` remain valid until the ring wraps
+        with self.space:
+            self.read_index += min(length, len(self))
+            self.space.notify_all()
+
+
+class FrameQueue():
+    def __init__(self, maxlen, policy='drop-newest', frame_pool=None, block_timeout_s=1.0):
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(f"Unknown capture queue policy '{policy}', expected one of {QUEUE_POLICIES}")
+
+        # Bounded queue of (timestamp_ns, frame, slot) entries between a video stream and the processor
+        self.maxlen = maxlen
+        self.policy = policy
+        self.frame_pool = frame_pool
+        self.block_timeout_s = block_timeout_s
+        self.frames = deque()
+        self.drops = DropLog()
+        self.space = threading.Condition()
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, index):
+        return self.frames[index]
+
+    def append(self, entry):
+        # Returns False if the incoming frame was dropped (its pooled buffer is released here)
+        with self.space:
+            if len(self.frames) >= self.maxlen:
+                if self.policy == 'block':
+                    self.space.wait_for(lambda: len(self.frames) < self.maxlen, timeout=self.block_timeout_s)
+                elif self.policy == 'drop-oldest':
+                    self.discard(self.frames.popleft())
+
+            if len(self.frames) >= self.maxlen:
+                self.discard(entry)
+                return False
+
+            self.frames.append(entry)
+            return True
+
+    def mark_gap(self, timestamp_ns):
+        # Record a frame the stream could not queue at all (e.g. no free pooled buffer)
+        self.drops.record(timestamp_ns)
+
+    def discard(self, entry):
+        timestamp_ns, _, slot = entry
+        self.drops.record(timestamp_ns)
+        if slot is not None: self.frame_pool.release(slot)
+
+    def take(self, count, overlap=0):
+        # Atomically remove the next `count` entries and peek the `overlap` entries after them, taking a reference on
+        # the peeked frames' pooled buffers so they cannot be dropped and recycled while the caller still reads them
+        with self.space:
+            taken = [self.frames.popleft() for _ in range(count)]
+            peeked = [self.frames[i] for i in range(overlap)]
+            if self.frame_pool is not None:
+                for _, _, slot in peeked:
+                    if slot is not None: self.frame_pool.retain(slot)
+
+            self.space.notify_all()
+
+        return taken + peeked
+
+
+class VideoFramePool():
+    def __init__(self, size, width=1280, height=720, channels=3, buffer=None):
+        # One contiguous preallocation that OpenCV decodes frames into, recycled once frames are written out
+        if buffer is not None:
+            self.frames = np.ndarray((size, height, width, channels), dtype=np.uint8, buffer=buffer)
+        else:
+            self.frames = np.zeros((size, height, width, channels), dtype=np.uint8)
+        self.free_slots = deque(range(size))
+        self.exhausted = 0
+
+        # Frames can be held by both the capture queue (overlap) and a segment being encoded at the same time
+        self.references = np.zeros(size, dtype=np.int32)
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.frames)
+
+    def available(self):
+        return len(self.free_slots)
+
+    def acquire(self):
+        # Index of a free frame buffer, or None when every buffer is still queued or being written
+        try:
+            slot = self.free_slots.popleft()
+        except IndexError:
+            return None
+
+        self.references[slot] = 1
+        return slot
+
+    def mark_exhausted(self):
+        # Count a frame dropped for want of a free buffer (once per frame, as a failed acquire may just be retried)
+        self.exhausted += 1
+
+    def retain(self, slot):
+        with self.lock:
+            self.references[slot] += 1
+
+    def release(self, slot):
+        with self.lock:
+            self.references[slot] -= 1
+            if self.references[slot] > 0:
+                return
+
+        self.free_slots.append(slot)
+
+
+class SharedVideoFramePool(VideoFramePool):
+    def __init__(self, size, width=1280, height=720, channels=3):
+        # Frame buffers in shared memory, so a capture process can decode frames straight into buffers the processor,
+        # encoder and detectors then read without copying. Slots are still only allocated and freed by this process.
+        self.shared_memory = shared_memory.SharedMemory(create=True, size=size * height * width * channels)
+        super().__init__(size, width, height, channels, buffer=self.shared_memory.buf)
+
+    @property
+    def name(self):
+        return self.shared_memory.name
+
+    def close(self):
+        # Only call once every frame view has been dropped (views still held elsewhere keep the mapping open)
+        self.frames = None
+        self.shared_memory.unlink()
+        try:
+            self.shared_memory.close()
+        except BufferError:
+            pass
@@ -0,0 +1,170 @@
+import os
+import cv2
+import time
+import numpy as np
+
+
+# Index records are (capture_ns, offset, length) int64 triples, one per frame, appended to `<segment>.index` as each
+# frame is written to `<segment>.mjpeg`. A final record with a capture time of -1 marks the segment as complete, and
+# an optional first record with a capture time of -2 gives the number of frames the segment is expected to hold.
+RECORD_FIELDS = 3
+RECORD_SIZE = RECORD_FIELDS * np.dtype(np.int64).itemsize
+COMPLETE_MARKER = -1
+LENGTH_MARKER = -2
+
+
+def segment_paths(path):
+    base = os.path.splitext(path)[0]
+    return f"{base}.mjpeg", f"{base}.index"
+
+
+class IndexedSegmentWriter():
+    def __init__(self, path, quality=90, expected_frames=None):
+        # Frames are stored as independent JPEGs so any frame can be decoded without the ones before it. Giving the
+        # `expected_frames` lets readers sample frames of the segment before it has been fully written.
+        self.data_path, self.index_path = segment_paths(path)
+        self.quality = quality
+        self.data_file = open(self.data_path, 'wb')
+        self.index_file = open(self.index_path, 'wb')
+        self.offset = 0
+        self.frame_count = 0
+
+        if expected_frames is not None:
+            self.write_record(LENGTH_MARKER, expected_frames, 0)
+
+    def write(self, frame, capture_ns):
+        success, encoded = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        if not success:
+            raise ValueError(f"Could not encode frame {self.frame_count} of {self.data_path}")
+
+        # Frame data is flushed before its index record, so readers never see a record for bytes not yet written
+        self.data_file.write(encoded.tobytes())
+        self.data_file.flush()
+        self.write_record(capture_ns, self.offset, len(encoded))
+
+        self.offset += len(encoded)
+        self.frame_count += 1
+
+    def write_record(self, capture_ns, offset, length):
+        self.index_file.write(np.array([capture_ns, offset, length], dtype=np.int64).tobytes())
+        self.index_file.flush()
+
+    def close(self):
+        self.write_record(COMPLETE_MARKER, self.frame_count, self.offset)
+        self.data_file.close()
+        self.index_file.close()
+
+
+class IndexedSegmentReader():
+    def __init__(self, path):
+        # Can be opened while the segment is still being written, `refresh` picks up frames written since
+        self.data_path, self.index_path = segment_paths(path)
+        self.data_file = open(self.data_path, 'rb')
+        self.index_file = open(self.index_path, 'rb')
+        self.records = np.empty((0, RECORD_FIELDS), dtype=np.int64)
+        self.partial_record = b''
+        self.expected_frames = None
+        self.complete = False
+        self.refresh()
+
+    def __len__(self):
+        return len(self.records)
+
+    def refresh(self):
+        # Read whole index records appended since the last refresh (a partly written record is kept for next time)
+        if self.complete:
+            return len(self.records)
+
+        data = self.partial_record + self.index_file.read()
+        usable = len(data) - len(data) % RECORD_SIZE
+        self.partial_record = data[usable:]
+
+        records = np.frombuffer(data[:usable], dtype=np.int64).reshape(-1, RECORD_FIELDS)
+        if len(records) > 0 and records[0, 0] == LENGTH_MARKER:
+            self.expected_frames = int(records[0, 1])
+            records = records[1:]
+
+        if len(records) > 0 and records[-1, 0] == COMPLETE_MARKER:
+            self.complete = True
+            records = records[:-1]
+
+        if len(records) > 0:
+            self.records = np.concatenate((self.records, records))
+
+        return len(self.records)
+
+    def capture_times(self):
+        return self.records[:, 0]
+
+    def frame(self, index):
+        _, offset, length = self.records[index]
+        self.data_file.seek(offset)
+        encoded = np.frombuffer(self.data_file.read(length), dtype=np.uint8)
+
+        return cv2.imdecode(encoded, cv2.IMREAD_COLOR)
+
+    def seek(self, capture_ns):
+        # Index of the last frame captured at or before `capture_ns`. Frames arrive at a near constant rate, so the
+        # position is estimated from the mean frame period and only corrected by the few frames of capture jitter.
+        frame_count = len(self.records)
+        if frame_count == 0:
+            raise IndexError(f"No frames written to {self.data_path} yet")
+
+        capture_ns_first, capture_ns_last = self.records[0, 0], self.records[-1, 0]
+        if capture_ns <= capture_ns_first:
+            return 0
+        if capture_ns >= capture_ns_last:
+            return frame_count - 1
+
+        period_ns = (capture_ns_last - capture_ns_first) / (frame_count - 1)
+        index = min(int((capture_ns - capture_ns_first) / period_ns), frame_count - 1)
+
+        while index > 0 and self.records[index, 0] > capture_ns:
+            index -= 1
+        while index < frame_count - 1 and self.records[index + 1, 0] <= capture_ns:
+            index += 1
+
+        return index
+
+    def frames(self, start=0, follow=True, poll_interval_s=0.05, timeout_s=30):
+        # Yields (capture_ns, frame) from `start`, waiting for frames still being written when following the segment
+        index = start
+        last_progress = time.monotonic()
+
+        while True:
+            if index < len(self.records):
+                yield int(self.records[index, 0]), self.frame(index)
+                index += 1
+                last_progress = time.monotonic()
+                continue
+
+            if self.refresh() > index:
+                continue
+
+            if self.complete or not follow or time.monotonic() - last_progress > timeout_s:
+                return
+
+            time.sleep(poll_interval_s)
+
+    def wait(self, frame_count=None, poll_interval_s=0.05, timeout_s=30):
+        # Block until `frame_count` frames are written (by default, until the segment is complete) or the segment
+        # completes or stops growing for `timeout_s`, returns the number of frames written
+        last_progress = time.monotonic()
+        written = self.refresh()
+
+        while not self.complete and (frame_count is None or written < frame_count) and time.monotonic() - last_progress < timeout_s:
+            time.sleep(poll_interval_s)
+            if self.refresh() > written:
+                written = len(self.records)
+                last_progress = time.monotonic()
+
+        return written
+
+    def read_all(self, follow=True):
+        # Decode the whole segment as (T, H, W, C), waiting for it to finish being written if following
+        frames = [frame for _, frame in self.frames(follow=follow)]
+        return np.stack(frames, axis=0)
+
+    def close(self):
+        self.data_file.close()
+        self.index_file.close()
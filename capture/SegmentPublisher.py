@@ -0,0 +1,92 @@
+import queue
+import threading
+
+
+class SegmentPublisher():
+    def __init__(self, modalities=('audio', 'video'), max_pending=4):
+        # Modalities the processor is actually producing segments for
+        self.modalities = tuple(modalities)
+        self.max_pending = max_pending
+        self.subscribers = []
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def has_subscribers(self):
+        return len(self.subscribers) > 0
+
+    def subscribe(self, callback, modalities=('audio', 'video'), paired=True, name=None):
+        # Each consumer runs on its own thread so slow detectors never stall segment collation.
+        # Paired consumers receive all their modalities for a segment index together, others receive each as it is ready.
+        required = tuple(m for m in modalities if m in self.modalities)
+        subscriber = {
+            'name': name or getattr(callback, '__qualname__', 'consumer'),
+            'callback': callback,
+            'modalities': required,
+            'paired': paired,
+            'queue': queue.Queue(maxsize=self.max_pending),
+            'dropped': 0
+        }
+
+        thread = threading.Thread(target=self.consume, args=(subscriber,), daemon=True)
+        subscriber['thread'] = thread
+        self.subscribers.append(subscriber)
+        thread.start()
+
+        return subscriber
+
+    def publish(self, modality, segment):
+        # Segments of the same index are grouped so consumers of several modalities receive them together
+        with self.lock:
+            index = segment['index']
+            grouped = self.pending.setdefault(index, {'index': index})
+            grouped[modality] = segment
+
+            for subscriber in self.subscribers:
+                if modality not in subscriber['modalities']:
+                    continue
+
+                if not subscriber['paired']:
+                    self.deliver(subscriber, {'index': index, modality: segment})
+                elif all(m in grouped for m in subscriber['modalities']):
+                    self.deliver(subscriber, {m: grouped[m] for m in subscriber['modalities']} | {'index': index})
+
+            if all(m in grouped for m in self.modalities):
+                del self.pending[index]
+
+            # Forget incomplete groups whose other modality was never collated
+            for stale_index in [i for i in self.pending if i < index - self.max_pending]:
+                del self.pending[stale_index]
+
+    def deliver(self, subscriber, segments):
+        # Consumers that fall behind skip the oldest waiting segment rather than holding frames in memory
+        while True:
+            try:
+                subscriber['queue'].put_nowait(segments)
+                return
+            except queue.Full:
+                try:
+                    subscriber['queue'].get_nowait()
+                    subscriber['dropped'] += 1
+                    print(f"Segment consumer '{subscriber['name']}' behind capture, skipped a segment")
+                except queue.Empty:
+                    pass
+
+    def consume(self, subscriber):
+        while True:
+            segments = subscriber['queue'].get()
+            if segments is None:
+                break
+
+            try:
+                subscriber['callback'](segments)
+            except Exception as e:
+                print(f"Segment consumer '{subscriber['name']}' failed on segment {segments['index']}: {e}")
+
+    def close(self, wait=True):
+        # Let consumers finish the segments already handed to them
+        for subscriber in self.subscribers:
+            subscriber['queue'].put(None)
+
+        if wait:
+            for subscriber in self.subscribers:
+                subscriber['thread'].join()
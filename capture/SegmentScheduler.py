@@ -0,0 +1,34 @@
+import threading
+
+
+class SegmentScheduler():
+    def __init__(self, timeout_s=1.0):
+        # Shared between capture stream threads (producers) and the AV processor (consumer)
+        self.condition = threading.Condition()
+        self.segment_lengths = {}
+        self.streamed = set()
+        self.timeout_s = timeout_s
+
+    def register(self, frame_queue, segment_length, streamed=False):
+        # Number of queued frames needed before a segment can be collated from this queue. Frames of a `streamed`
+        # queue are written out as they arrive, so the processor is woken for every frame rather than every segment.
+        self.segment_lengths[id(frame_queue)] = segment_length
+        if streamed:
+            self.streamed.add(id(frame_queue))
+
+    def segment_ready(self, frame_queue):
+        segment_length = self.segment_lengths.get(id(frame_queue))
+        return segment_length is not None and len(frame_queue) >= segment_length
+
+    def notify(self, frame_queue=None):
+        # Stream threads call this after queueing a frame, the processor is only woken once a full segment exists
+        # (or for each frame of a streamed queue). Calling without a queue always wakes the processor (e.g. when a
+        # stream closes).
+        if frame_queue is None or id(frame_queue) in self.streamed or self.segment_ready(frame_queue):
+            with self.condition:
+                self.condition.notify_all()
+
+    def wait(self, predicate):
+        # Sleep until the predicate holds, re-checking at least every `timeout_s` in case a signal was missed
+        with self.condition:
+            return self.condition.wait_for(predicate, timeout=self.timeout_s)
@@ -0,0 +1,123 @@
+import os
+import cv2
+import time
+import threading
+import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class SegmentWriterPool():
+    def __init__(self, workers=2, frame_pool=None, latency_history=100, telemetry=None):
+        # OpenCV releases the GIL while encoding so worker threads run alongside capture and collation
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='segment-writer')
+        self.frame_pool = frame_pool
+
+        # Segments complete in any order but callbacks are delivered in submission order
+        self.lock = threading.RLock()
+        self.submitted = 0
+        self.next_callback = 0
+        self.finished = {}
+        self.callbacks = {}
+
+        self.encode_latencies = deque(maxlen=latency_history)
+        self.max_queue_depth = 0
+        self.telemetry = telemetry
+
+    def queue_depth(self):
+        # Segments submitted but not yet encoded and written
+        with self.lock:
+            return self.submitted - self.next_callback - len(self.finished)
+
+    def submit(self, file_path, frames, fps, frame_shape, slots=(), callback=None, frame_pool=None):
+        # Pooled `slots` are released to `frame_pool` (or the pool given to the writer) once the segment is written,
+        # so one writer pool can be shared by captures with their own frame pools
+        with self.lock:
+            sequence = self.submitted
+            self.submitted += 1
+            self.callbacks[sequence] = callback
+            self.max_queue_depth = max(self.max_queue_depth, self.submitted - self.next_callback)
+
+        frame_pool = frame_pool if frame_pool is not None else self.frame_pool
+        return self.executor.submit(self.encode, sequence, file_path, frames, fps, frame_shape, slots, frame_pool)
+
+    def encode(self, sequence, file_path, frames, fps, frame_shape, slots=(), frame_pool=None):
+        encode_start = time.monotonic()
+        error = None
+
+        try:
+            self.write_mp4(file_path, frames, fps, frame_shape)
+        except Exception as e:
+            # Still complete the segment so callbacks for later segments are not held back
+            error = e
+            print(f"Error writing segment {file_path}: {e}")
+        finally:
+            # Pooled frame buffers can be reused by capture once encoded (or if encoding failed)
+            if frame_pool is not None:
+                for slot in slots:
+                    frame_pool.release(slot)
+
+        encode_latency = time.monotonic() - encode_start
+        self.encode_latencies.append(encode_latency)
+        if self.telemetry is not None:
+            self.telemetry.observe('video.encode_time', encode_latency)
+            if error is not None: self.telemetry.increment('video.encode_failures')
+        result = {
+            'index': sequence,
+            'file': file_path,
+            'frames': len(frames),
+            'encode_time': encode_latency,
+            'error': error
+        }
+
+        self.complete(sequence, result)
+        return result
+
+    @staticmethod
+    def write_mp4(file_path, frames, fps, frame_shape):
+        # Encoded under a hidden name and renamed once closed, so a segment file is only visible once complete
+        directory, file_name = os.path.split(file_path)
+        partial_path = os.path.join(directory, f".{file_name}")
+
+        output_file = cv2.VideoWriter(partial_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, frame_shape)
+        for frame in frames:
+            output_file.write(frame)
+        output_file.release()
+
+        os.replace(partial_path, file_path)
+
+    def complete(self, sequence, result):
+        # Deliver callbacks for every segment that is now contiguous with those already reported
+        with self.lock:
+            self.finished[sequence] = result
+
+            while self.next_callback in self.finished:
+                result = self.finished.pop(self.next_callback)
+                callback = self.callbacks.pop(self.next_callback)
+                self.next_callback += 1
+
+                if callback is not None:
+                    callback(result)
+
+    def stats(self):
+        latencies = np.array(self.encode_latencies)
+
+        return {
+            'workers': self.workers,
+            'segments_written': self.next_callback,
+            'queue_depth': self.queue_depth(),
+            'max_queue_depth': self.max_queue_depth,
+            'mean_encode_time': float(latencies.mean()) if len(latencies) > 0 else 0.0,
+            'max_encode_time': float(latencies.max()) if len(latencies) > 0 else 0.0
+        }
+
+    def summary_line(self):
+        stats = self.stats()
+        return (f"Segment encoding: {stats['segments_written']} segments by {stats['workers']} workers, "
+                f"mean {stats['mean_encode_time']:.2f}s / max {stats['max_encode_time']:.2f}s per segment, "
+                f"max queue depth {stats['max_queue_depth']}")
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
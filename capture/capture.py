@@ -1,13 +1,20 @@
 import os
+import sys
+import math
 import signal
 import argparse
 import sounddevice
 from pathlib import Path
 from threading import Thread
-from collections import deque
 
 from AudioVisualProcessor import AudioVisualProcessor
-from AudioVisualStreams import AudioStream, VideoStream, CombinedCaptureStream
+from SegmentScheduler import SegmentScheduler
+from FrameBuffers import QUEUE_POLICIES, AudioRingBuffer, FrameQueue, VideoFramePool, SharedVideoFramePool
+from SegmentWriter import SegmentWriterPool
+from SegmentPublisher import SegmentPublisher
+from CaptureClock import CaptureClock
+from CaptureTelemetry import CaptureTelemetry
+from AudioVisualStreams import AudioStream, VideoStream, ProcessVideoStream, CombinedCaptureStream, FileAudioStream, FileVideoStream
 
 
 if __name__ == '__main__':
@@ -19,35 +26,73 @@ if __name__ == '__main__':
 
     ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     OUTPUT_DIR = os.path.join(ROOT_DIR, "output/capture/")
+    SEGMENT_LENGTH_S = 20
+    SEGMENT_OVERLAP_S = 1
+    CAPTURE_QUEUE_LENGTH_S = 25
 
     parser.add_argument('-m', '--setup-mode', action='store_true', default=False, help="display video to be captured in setup mode with no capture/processing")
     parser.add_argument('-na', '--no-audio', action='store_false', default=True, help="do not include audio in captured segments")
     parser.add_argument('-nv', '--no-video', action='store_false', default=True, help="do not include video in captured segments")
     parser.add_argument('-s', '--split-av-out', action='store_true', default=False, help="output audio and video in separate files (WAV and MP4)")
-    parser.add_argument('-a', '--audio', type=int, default=0, help="index of input audio device")
-    parser.add_argument('-v', '--video', type=int, default=0, help="index of input video device")
+    parser.add_argument('-a', '--audio', type=int, nargs='+', default=[0], help="index of input audio device (several to capture multiple rigs, paired in order with --video)")
+    parser.add_argument('-v', '--video', type=int, nargs='+', default=[0], help="index of input video device (several to capture multiple rigs, paired in order with --audio)")
     parser.add_argument('-o', '--output-path', type=str, default=OUTPUT_DIR, help="directory to output captured video segments to")
+    parser.add_argument('-ac', '--audio-callback', action='store_true', default=False, help="capture audio through the PortAudio callback API instead of a blocking read thread")
+    parser.add_argument('-vp', '--video-process', action='store_true', default=False, help="read each video device in its own process, passing frames through shared memory")
+    parser.add_argument('-w', '--writer-workers', type=int, default=2, help="number of background workers encoding video segments")
+    parser.add_argument('-c', '--video-container', type=str, choices=['mp4', 'mjpeg'], default='mp4', help="split video segment format (mjpeg segments are indexed per frame and readable while being written)")
+    parser.add_argument('-px', '--proxy', action='store_true', default=False, help="also save a low resolution proxy of each combined segment (25 fps, 256 px, 16 kHz) for AV sync detection (ffmpeg backend only)")
+    parser.add_argument('-q', '--queue-policy', type=str, choices=QUEUE_POLICIES, default='drop-newest', help="behaviour of the bounded capture queues when processing falls behind")
+    parser.add_argument('-ns', '--no-save', action='store_true', default=False, help="do not save AV segment files (only pass segments to in-memory detectors)")
+    parser.add_argument('-t', '--telemetry-interval', type=float, default=10, help="seconds between capture telemetry summaries")
+    parser.add_argument('-j', '--telemetry-json', type=str, default=None, help="file to export capture telemetry to as JSON (updated with each summary)")
+    parser.add_argument('-ra', '--replay-audio', type=str, default=None, help="replay a WAV file in place of the audio device")
+    parser.add_argument('-rv', '--replay-video', type=str, default=None, help="replay a video file in place of the video device")
+    parser.add_argument('-rs', '--replay-speed', type=float, default=1.0, help="replay speed as a multiple of real time (0 to replay as fast as possible)")
+    parser.add_argument('-rj', '--replay-jitter', type=float, default=0, help="maximum random delay (ms) injected into replayed frames")
+    parser.add_argument('-rd', '--replay-drop-rate', type=float, default=0, help="probability of dropping each replayed frame/chunk")
+    parser.add_argument('-b', '--backend', type=str, choices=['videosnap', 'ffmpeg'], default='videosnap', help="combined AV capture backend (VideoSnap on macOS, a single segmenting ffmpeg process on Linux)")
+    parser.add_argument('-ts', '--test-source', action='store_true', default=False, help="capture ffmpeg test sources (testsrc/sine) instead of devices (ffmpeg backend only)")
+    parser.add_argument('-d', '--detect', nargs='+', choices=['stutter', 'sync'], default=[], help="detectors to run in-process on captured segments (split AV capture only)")
 
     # Decode input parameters to toggle between cameras, microphones, and setup mode.
     args = parser.parse_args()
-    audio_device = args.audio
-    video_device = args.video
     output_path = args.output_path
-    save_av_files = True
+    writer_workers = args.writer_workers
+    detectors = args.detect
+    save_av_files = not args.no_save
 
     global audio_on, video_on, setup_mode_only, audio, video
     audio_on = args.no_audio
     video_on = args.no_video
     setup_mode_only = args.setup_mode
-    split_audio_video = args.split_av_out or not audio_on or not video_on
+    split_audio_video = args.split_av_out or not audio_on or not video_on or args.replay_audio is not None or args.replay_video is not None
+    replay_options = dict(speed=args.replay_speed, jitter_ms=args.replay_jitter, drop_rate=args.replay_drop_rate)
+
+    # Proxies are read by AV sync detection, which runs on combined segments, and only the ffmpeg backend writes them
+    write_proxies = args.proxy and not split_audio_video and args.backend == 'ffmpeg'
+    if args.proxy and not write_proxies:
+        print("Warning: --proxy is only supported for combined capture with the ffmpeg backend (-b ffmpeg), no proxies will be written")
+
+    # Each rig is an audio/video device pair captured concurrently in this process (with its own output subdirectory)
+    rig_count = max(len(args.audio) if audio_on else 1, len(args.video) if video_on else 1)
+    if audio_on and video_on and len(args.audio) != len(args.video):
+        parser.error(f"{len(args.audio)} audio and {len(args.video)} video devices given, each rig needs one of each")
+
+    audio_devices = args.audio if audio_on else [None] * rig_count
+    video_devices = args.video if video_on else [None] * rig_count
+    audio_device, video_device = audio_devices[0], video_devices[0]
+    rig_output_path = lambda rig: output_path if rig_count == 1 else os.path.join(output_path, f"rig{rig}/")
 
     print("PRESS 'CTRL+C' TO STOP CAPTURE")
-    print(f"\nAudio devices available: \n{sounddevice.query_devices()}", end='\n\n')
+    if args.replay_audio is None and not args.test_source: print(f"\nAudio devices available: \n{sounddevice.query_devices()}", end='\n\n')
     print(f" * Processes:")
     print(f"     * Audio                      : {audio_on}")
     print(f"     * Video                      : {video_on}")
     print(f"     * Save AV segment files      : {save_av_files}")
+    print(f"     * Capture rigs               : {rig_count}")
     print(f"     * Split audio & video tracks : {split_audio_video}",)
+    if not split_audio_video: print(f"     * Combined capture backend   : {args.backend}{' (test source)' if args.test_source else ''}")
     print(f"     * Setup mode (no processing) : {setup_mode_only}", end='\n\n')
     print(f" * Capture setup:")
 
@@ -60,71 +105,168 @@ if __name__ == '__main__':
 
     # Combined audio & video capture
     elif not split_audio_video:
-        # Generate segment output location
-        if save_av_files:
-            av_save_path = os.path.join(output_path, "segments/")
+        capture_threads = []
+        for rig, (audio_device, video_device) in enumerate(zip(audio_devices, video_devices)):
+            # Generate segment output location
+            av_save_path = os.path.join(rig_output_path(rig), "segments/")
             Path(av_save_path).mkdir(parents=True, exist_ok=True)
 
-        # Set up and launch combined audio-video stream in a thread
-        capture = CombinedCaptureStream(audio_device, video_device, av_save_path)
-        audio_frame_queue = deque()
-        capture_thread = Thread(target=capture.launch, args=())
-        capture_thread.start()
+            # Set up and launch combined audio-video stream in a thread
+            capture = CombinedCaptureStream(audio_device, video_device, av_save_path, backend=args.backend, test_source=args.test_source, proxy=write_proxies)
+            capture_thread = Thread(target=capture.launch, args=())
+            capture_thread.start()
+            capture_threads.append(capture_thread)
 
     # Separate audio & video capture
     else:
-        # Set up and launch separate audio-video stream threads
-        if audio_on:
-            # Generate audio output location
-            if save_av_files:
-                audio_save_path = os.path.join(output_path, "audio/")
-                Path(audio_save_path).mkdir(parents=True, exist_ok=True)
-
-            # Launch audio thread
-            audio = AudioStream(device=audio_device)
-            audio_frame_queue = deque()
-            audio_thread = Thread(target=audio.launch, args=(audio_frame_queue,))
-            audio_thread.start()
-
-        if video_on:
-            # Generate video output location
-            if save_av_files:
-                video_save_path = os.path.join(output_path, "video/")
-                Path(video_save_path).mkdir(parents=True, exist_ok=True)
-
-            # Launch video thread
-            video_frame_queue = deque()
-            video = VideoStream(device=video_device)
-            video_thread = Thread(target=video.launch, args=(video_frame_queue,))
-            video_thread.start()
-
-        # Run capture and save av segments to local storage (if requested)
-        if audio_on and video_on:
-            processor = AudioVisualProcessor(
-                video_fps=video.frame_rate, video_shape=(video.width, video.height),
-                audio_save_path=audio_save_path, video_save_path=video_save_path
-            )
+        clock = CaptureClock()
 
-            processor.process(
-                audio_module=audio, audio_frames=audio_frame_queue, audio_channels=1,
-                video_module=video, video_frames=video_frame_queue,
-                checkpoint_files=save_av_files
-            )
-        elif video_on:
-            processor = AudioVisualProcessor(
-                video_fps=video.frame_rate, video_shape=(video.width, video.height),
-                video_save_path=video_save_path
-            )
+        # Periodic summary of capture rates, drops, queue depths and stage latencies (metrics prefixed by rig if several)
+        telemetry = CaptureTelemetry(summary_interval_s=args.telemetry_interval, json_path=args.telemetry_json)
+        telemetry.start()
 
-            processor.process(
-                video_module=video, video_frames=video_frame_queue,
-                checkpoint_files=save_av_files, audio_on=False
-            )
-        elif audio_on:
-            processor = AudioVisualProcessor(audio_save_path=audio_save_path)
-            processor.process(
-                audio_module=audio, audio_frames=audio_frame_queue, audio_channels=1,
-                checkpoint_files=save_av_files, video_on=False
+        # Encode finished video segments of every rig in the background while capture continues
+        segment_writer = SegmentWriterPool(workers=writer_workers, telemetry=telemetry) if video_on else None
+
+        if 'stutter' in detectors:
+            sys.path.append(os.path.join(ROOT_DIR, "stutter_detection"))
+            from StutterDetection import StutterDetection
+
+        if 'sync' in detectors and audio_on and video_on:
+            sys.path.append(os.path.join(ROOT_DIR, "av_sync_detection"))
+            from AVSyncDetection import AVSyncDetection
+
+        processor_threads = []
+        shared_frame_pools = []
+        for rig, (audio_device, video_device) in enumerate(zip(audio_devices, video_devices)):
+            rig_name = f"rig{rig}" if rig_count > 1 else ''
+            rig_telemetry = telemetry.scope(rig_name) if rig_name else telemetry
+            rig_path = rig_output_path(rig)
+            audio = video = None
+            audio_frame_queue = video_frame_queue = video_frame_pool = None
+            audio_save_path = video_save_path = ''
+
+            # Streams wake the processor through the scheduler once a full segment has been captured
+            scheduler = SegmentScheduler()
+
+            # Detectors receive finished segments straight from the processor rather than re-reading files
+            publisher = SegmentPublisher(modalities=[m for m, on in (('audio', audio_on), ('video', video_on)) if on])
+            detection_output_path = os.path.join(rig_path, "detection/")
+            Path(detection_output_path).mkdir(parents=True, exist_ok=True)
+
+            if 'stutter' in detectors:
+                stutter_detector = StutterDetection()
+                publisher.subscribe(
+                    lambda segments, detector=stutter_detector, path=detection_output_path: detector.process_segment(segments, output_directory=path),
+                    modalities=('audio', 'video'), paired=False, name=f'{rig_name} stutter'.strip()
+                )
+
+            if 'sync' in detectors and audio_on and video_on:
+                sync_detector = AVSyncDetection()
+                sync_detector.load_model()
+                publisher.subscribe(
+                    lambda segments, detector=sync_detector, path=detection_output_path: detector.process_segment(segments, plot=True, output_directory=path),
+                    modalities=('audio', 'video'), name=f'{rig_name} sync'.strip()
+                )
+
+            # Set up and launch separate audio-video stream threads
+            if audio_on:
+                # Generate audio output location
+                if save_av_files:
+                    audio_save_path = os.path.join(rig_path, "audio/")
+                    Path(audio_save_path).mkdir(parents=True, exist_ok=True)
+
+                # Launch audio thread
+                if args.replay_audio is not None:
+                    audio = FileAudioStream(args.replay_audio, telemetry=rig_telemetry, **replay_options)
+                else:
+                    audio = AudioStream(device=audio_device, callback_mode=args.audio_callback, telemetry=rig_telemetry)
+
+                audio_frame_queue = AudioRingBuffer(
+                    capacity_s=CAPTURE_QUEUE_LENGTH_S, sample_rate=audio.rate, chunk_size=audio.chunk,
+                    channels=audio.audio_channels, policy=args.queue_policy
+                )
+                audio_thread = Thread(target=audio.launch, args=(audio_frame_queue, scheduler))
+                audio_thread.start()
+
+            if video_on:
+                # Generate video output location
+                if save_av_files:
+                    video_save_path = os.path.join(rig_path, "video/")
+                    Path(video_save_path).mkdir(parents=True, exist_ok=True)
+
+                # Launch video thread
+                if args.replay_video is not None:
+                    video = FileVideoStream(args.replay_video, telemetry=rig_telemetry, **replay_options)
+                elif args.video_process:
+                    video = ProcessVideoStream(device=video_device, telemetry=rig_telemetry)
+                else:
+                    video = VideoStream(device=video_device, telemetry=rig_telemetry)
+
+                # Preallocated frame buffers (in shared memory when frames are read by a separate capture process).
+                # A segment holds its buffers until encoded, so there is room for the segment being captured, one
+                # being encoded by each writer worker, and the overlap kept for the next segment.
+                pool_size = math.ceil(video.frame_rate * (SEGMENT_LENGTH_S * (writer_workers + 1) + SEGMENT_OVERLAP_S))
+                if isinstance(video, ProcessVideoStream):
+                    video_frame_pool = SharedVideoFramePool(pool_size, video.width, video.height)
+                    shared_frame_pools.append(video_frame_pool)
+                else:
+                    video_frame_pool = VideoFramePool(pool_size, video.width, video.height)
+                video_frame_queue = FrameQueue(math.ceil(video.frame_rate * CAPTURE_QUEUE_LENGTH_S), policy=args.queue_policy, frame_pool=video_frame_pool)
+                video_thread = Thread(target=video.launch, args=(video_frame_queue, False, scheduler, video_frame_pool))
+                video_thread.start()
+
+            # Run capture and save av segments to local storage (if requested), one processing thread per rig
+            segment_lengths = dict(
+                audio_buffer_len_s=SEGMENT_LENGTH_S, audio_overlap_len_s=SEGMENT_OVERLAP_S,
+                video_buffer_len_s=SEGMENT_LENGTH_S, video_overlap_len_s=SEGMENT_OVERLAP_S
             )
-        else:
-            exit(0)
+            if audio_on and video_on:
+                processor = AudioVisualProcessor(
+                    video_fps=video.frame_rate, video_shape=(video.width, video.height),
+                    audio_save_path=audio_save_path, video_save_path=video_save_path,
+                    video_container=args.video_container, clock=clock, telemetry=rig_telemetry, name=rig_name,
+                    **segment_lengths
+                )
+                process_args = dict(
+                    audio_module=audio, audio_frames=audio_frame_queue, audio_channels=1,
+                    video_module=video, video_frames=video_frame_queue,
+                    checkpoint_files=save_av_files, scheduler=scheduler, video_frame_pool=video_frame_pool,
+                    segment_writer=segment_writer, publisher=publisher
+                )
+            elif video_on:
+                processor = AudioVisualProcessor(
+                    video_fps=video.frame_rate, video_shape=(video.width, video.height),
+                    video_save_path=video_save_path, video_container=args.video_container, clock=clock,
+                    telemetry=rig_telemetry, name=rig_name, **segment_lengths
+                )
+                process_args = dict(
+                    video_module=video, video_frames=video_frame_queue,
+                    checkpoint_files=save_av_files, audio_on=False, scheduler=scheduler, video_frame_pool=video_frame_pool,
+                    segment_writer=segment_writer, publisher=publisher
+                )
+            elif audio_on:
+                processor = AudioVisualProcessor(audio_save_path=audio_save_path, clock=clock, telemetry=rig_telemetry, name=rig_name, **segment_lengths)
+                process_args = dict(
+                    audio_module=audio, audio_frames=audio_frame_queue, audio_channels=1,
+                    checkpoint_files=save_av_files, video_on=False, scheduler=scheduler, publisher=publisher
+                )
+            else:
+                exit(0)
+
+            processor_thread = Thread(target=processor.process, kwargs=process_args)
+            processor_thread.start()
+            processor_threads.append(processor_thread)
+
+        for processor_thread in processor_threads:
+            processor_thread.join()
+
+        # Wait for every rig's queued segments to finish encoding
+        if segment_writer is not None:
+            segment_writer.shutdown(wait=True)
+            print(segment_writer.summary_line())
+
+        for frame_pool in shared_frame_pools:
+            frame_pool.close()
+
+        telemetry.stop()
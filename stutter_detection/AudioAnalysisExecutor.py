@@ -0,0 +1,114 @@
+import threading
+import numpy as np
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+
+from EssentiaAudioDetector import AudioDetector
+
+
+AUDIO_DETECTORS = ('gaps', 'discontinuities', 'clicks')
+
+
+def analyse_channel(shared_memory_name, shape, dtype, channel, detector, peak):
+    # Runs in a pool worker: one detector over one channel of a segment held in shared memory
+    segment_memory = shared_memory.SharedMemory(name=shared_memory_name)
+    try:
+        samples = np.ndarray(shape, dtype=dtype, buffer=segment_memory.buf)
+        normalised_channel = (samples[channel] / peak).astype(np.float32)
+        del samples
+    finally:
+        segment_memory.close()
+
+    detections = AudioDetector().raw_detection(
+        [normalised_channel],
+        gap_detection=detector == 'gaps',
+        discontinuity_detection=detector == 'discontinuities',
+        click_detection=detector == 'clicks'
+    )
+    return detections[detector]
+
+
+class AudioAnalysis():
+    def __init__(self, futures, segment_memory, start_time, executor):
+        # Pending (channel, detector) analyses of one segment, merged by `result` into `AudioDetector.process` output
+        self.futures = futures
+        self.segment_memory = segment_memory
+        self.start_time = start_time
+        self.executor = executor
+        self.results = None
+
+    def result(self):
+        if self.results is not None:
+            return self.results
+
+        try:
+            detections = {detector: [future.result() for future in futures] for detector, futures in self.futures.items()}
+        finally:
+            self.executor.release(self)
+
+        # Channels are merged in order, as `AudioDetector` does when it walks the channels itself
+        gaps, discontinuities, clicks = [], [], []
+        if 'gaps' in detections:
+            gaps = AudioDetector.format_gaps(
+                [start for channel_starts, _ in detections['gaps'] for start in channel_starts],
+                [end for _, channel_ends in detections['gaps'] for end in channel_ends],
+                self.start_time
+            )
+        if 'discontinuities' in detections:
+            discontinuities = AudioDetector.format_times([t for channel_times in detections['discontinuities'] for t in channel_times], self.start_time)
+        if 'clicks' in detections:
+            clicks = AudioDetector.format_times([t for channel_times in detections['clicks'] for t in channel_times], self.start_time)
+
+        self.results = {
+            'gaps': gaps,
+            'discontinuities': discontinuities,
+            'clicks': clicks
+        }
+        return self.results
+
+
+class AudioAnalysisExecutor():
+    def __init__(self, workers=None):
+        # Spreads (segment, channel, detector) analyses over a process pool. Each segment's samples are copied once
+        # into shared memory that the workers read, rather than being pickled to every task.
+        self.pool = ProcessPoolExecutor(max_workers=workers)
+        self.pending = set()
+        self.lock = threading.Lock()
+
+    def submit(self, audio, start_time=0, gap_detection=True, discontinuity_detection=True, click_detection=False):
+        # `audio` is (channels, samples) as taken by `AudioDetector.process`; returns an `AudioAnalysis`
+        audio = np.asarray(audio)
+        peak = np.max(np.abs(audio))
+
+        segment_memory = shared_memory.SharedMemory(create=True, size=max(audio.nbytes, 1))
+        np.ndarray(audio.shape, dtype=audio.dtype, buffer=segment_memory.buf)[:] = audio
+
+        enabled = {'gaps': gap_detection, 'discontinuities': discontinuity_detection, 'clicks': click_detection}
+        futures = {
+            detector: [
+                self.pool.submit(analyse_channel, segment_memory.name, audio.shape, audio.dtype.str, channel, detector, peak)
+                for channel in range(audio.shape[0])
+            ]
+            for detector in AUDIO_DETECTORS if enabled[detector]
+        }
+
+        analysis = AudioAnalysis(futures, segment_memory, start_time, self)
+        with self.lock:
+            self.pending.add(analysis)
+
+        return analysis
+
+    def release(self, analysis):
+        # Free a segment's shared memory once its analyses have finished
+        with self.lock:
+            if analysis not in self.pending:
+                return
+            self.pending.discard(analysis)
+
+        analysis.segment_memory.close()
+        analysis.segment_memory.unlink()
+
+    def shutdown(self):
+        self.pool.shutdown(wait=True)
+        for analysis in list(self.pending):
+            self.release(analysis)
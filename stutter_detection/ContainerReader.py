@@ -0,0 +1,168 @@
+import av
+import numpy as np
+
+from EssentiaAudioDetector import SAMPLE_RATE
+
+
+class ContainerReader():
+    def __init__(self, path, chunk_s=30, sample_rate=SAMPLE_RATE):
+        # Audio and video streams of a (combined mp4) container. `decode` demuxes both together in one pass, while
+        # long audio is left to `chunks`, which decodes it a chunk at a time as `WavReader` reads a WAV file (float32,
+        # resampled to the detectors' rate).
+        self.path = path
+        self.container = av.open(path)
+        self.audio_stream = self.container.streams.audio[0] if len(self.container.streams.audio) > 0 else None
+        self.video_stream = self.container.streams.video[0] if len(self.container.streams.video) > 0 else None
+
+        self.sample_rate = sample_rate
+        self.chunk_s = chunk_s
+        self.channels = len(self.audio_stream.layout.channels) if self.audio_stream is not None else 0
+        self.header_length = self.audio_length_from_header()
+        self.decoded_samples = None
+        self.peak_value = None
+
+    def audio_length_from_header(self):
+        # Audio length (samples at `sample_rate`) from the container header, without decoding
+        if self.audio_stream is None:
+            return 0
+
+        if self.audio_stream.duration is not None:
+            duration_s = float(self.audio_stream.duration * self.audio_stream.time_base)
+        elif self.container.duration is not None:
+            duration_s = self.container.duration / av.time_base
+        else:
+            duration_s = 0
+
+        return round(duration_s * self.sample_rate)
+
+    @property
+    def frame_count(self):
+        # Video frame count from the container header (without decoding), 0 if unknown
+        return max(self.video_stream.frames, 0) if self.video_stream is not None else 0
+
+    @property
+    def samples(self):
+        # (channels, samples) audio, decoded whole on first use unless `decode` already did
+        if self.decoded_samples is None:
+            chunks = list(self.chunks())
+            self.decoded_samples = np.concatenate(chunks, axis=1) if len(chunks) > 0 else np.empty((self.channels, 0), dtype=np.float32)
+
+        return self.decoded_samples
+
+    @property
+    def shape(self):
+        return (self.channels, len(self))
+
+    def __len__(self):
+        # Exact once the audio has been decoded, otherwise as the header gives it
+        return self.decoded_samples.shape[1] if self.decoded_samples is not None else self.header_length
+
+    def peak(self):
+        # Absolute peak over every channel, found a chunk at a time (a separate pass over the audio if not decoded)
+        if self.peak_value is None:
+            self.peak_value = 0
+            for chunk in self.chunks():
+                self.peak_value = max(self.peak_value, float(np.max(np.abs(chunk))))
+
+        return self.peak_value
+
+    def chunks(self):
+        # Yields consecutive (channels, samples) chunks of `chunk_s`, decoding only as much of the audio as the next
+        # chunk needs
+        chunk_length = max(int(self.chunk_s * self.sample_rate), 1)
+        if self.decoded_samples is not None:
+            for start in range(0, self.decoded_samples.shape[1], chunk_length):
+                yield self.decoded_samples[:, start:start + chunk_length]
+            return
+
+        pending, pending_length = [], 0
+        for samples in self.decode_audio():
+            pending.append(samples)
+            pending_length += samples.shape[1]
+
+            if pending_length >= chunk_length:
+                buffered = np.concatenate(pending, axis=1)
+                for start in range(0, pending_length - chunk_length + 1, chunk_length):
+                    yield buffered[:, start:start + chunk_length]
+
+                pending = [buffered[:, start + chunk_length:]]
+                pending_length = pending[0].shape[1]
+
+        if pending_length > 0:
+            yield np.concatenate(pending, axis=1)
+
+    def decode_audio(self):
+        # Resampled (channels, samples) blocks of the audio track, from a pass over the file of its own, so audio can
+        # still be read once `decode` has been run and the reader closed
+        if self.audio_stream is None:
+            return
+
+        with av.open(self.path) as container:
+            stream = container.streams.audio[0]
+            resampler = av.AudioResampler(format='fltp', layout=stream.layout.name, rate=self.sample_rate)
+
+            for packet in container.demux(stream):
+                # A flushing packet (dts None) decodes the frames the codec still holds
+                for frame in packet.decode():
+                    for resampled in resampler.resample(frame):
+                        yield resampled.to_ndarray()
+
+            for resampled in resampler.resample(None):
+                yield resampled.to_ndarray()
+
+    def decode(self, audio=True, video=True, frame_indices=None, frame_transform=None):
+        # One pass over the container's packets, decoding audio into `samples` and video frames (BGR, as OpenCV
+        # decodes them) into an array. With sorted `frame_indices`, frames in between are decoded but not converted,
+        # and the indices actually decoded are returned alongside the frames.
+        streams = [stream for stream, wanted in ((self.audio_stream, audio), (self.video_stream, video)) if stream is not None and wanted]
+
+        audio_chunks = []
+        resampler = av.AudioResampler(format='fltp', layout=self.audio_stream.layout.name, rate=self.sample_rate) if audio and self.audio_stream is not None else None
+
+        frame_buffer = []
+        video_asset = None
+        decoded = 0
+        wanted_frames = iter(frame_indices) if frame_indices is not None else None
+        next_frame = next(wanted_frames, None) if wanted_frames is not None else None
+        position = 0
+
+        for packet in self.container.demux(streams):
+            if packet.stream.type == 'audio':
+                # A flushing packet (dts None) decodes the frames the codec still holds
+                for frame in packet.decode():
+                    audio_chunks.extend(resampled.to_ndarray() for resampled in resampler.resample(frame))
+
+            elif packet.stream.type == 'video':
+                for frame in packet.decode():
+                    if wanted_frames is None or position == next_frame:
+                        image = frame.to_ndarray(format='bgr24')
+                        image = frame_transform(image) if frame_transform is not None else image
+
+                        if wanted_frames is None:
+                            frame_buffer.append(image)
+                        else:
+                            # Sampled frames go straight into one preallocated array
+                            if video_asset is None:
+                                video_asset = np.empty((len(frame_indices), *image.shape), dtype=image.dtype)  # dimensions (T, H, W, C)
+                            video_asset[decoded] = image
+                            decoded += 1
+                            next_frame = next(wanted_frames, None)
+                    position += 1
+
+        if resampler is not None:
+            audio_chunks.extend(resampled.to_ndarray() for resampled in resampler.resample(None))
+            self.decoded_samples = np.concatenate(audio_chunks, axis=1) if len(audio_chunks) > 0 else np.empty((self.channels, 0), dtype=np.float32)  # dimensions (channels, samples)
+
+        if not video or self.video_stream is None:
+            return None, None
+
+        if len(frame_buffer) == 0 and decoded == 0:
+            raise ValueError(f"No frames could be decoded from {self.path}")
+
+        if frame_indices is None:
+            return np.stack(frame_buffer, axis=0), None  # dimensions (T, H, W, C)
+
+        return video_asset[:decoded], np.asarray(frame_indices[:decoded])
+
+    def close(self):
+        self.container.close()
@@ -1,29 +1,222 @@
 from essentia.standard import FrameGenerator, GapsDetector, ClickDetector, DiscontinuityDetector
 import numpy as np
 import datetime
-from tqdm import tqdm
+import itertools
+
+# Sample rate the detectors assume (Essentia's default), used to place their detections in time
+SAMPLE_RATE = 44100
+
+# Analysis parameters of each detector
+GAP_PARAMETERS = {
+    'frameSize': 1024, 'hopSize': 512,  # frame & hop size used for the analysis
+    'minimumTime': 10,                  # time of the minimum gap duration [ms]
+    'prepowerThreshold': -38,           # prepower threshold [dB]
+    'silenceThreshold': -45             # silence threshold [dB]
+}
+DISCONTINUITY_PARAMETERS = {
+    'frameSize': 512, 'hopSize': 256,   # frame & hop size used for the analysis
+    'detectionThreshold': 8,            # threshold is T * s.d. + median
+    'energyThreshold': -60,             # detect silent subframes [dB]
+    'silenceThreshold': -50             # skip silent frames [dB]
+}
+CLICK_PARAMETERS = {
+    'frameSize': 512, 'hopSize': 256    # frame & hop size used for the analysis
+}
+
+# Samples of a streamed segment normalised and analysed at a time (bounding the float copy of long segments)
+STREAM_BLOCK_LENGTH = 10 * SAMPLE_RATE
+# Largest jump between segment start times (s) still treated as the stream following on
+STREAM_TOLERANCE_S = 0.05
+
+
+class DetectorStream():
+    def __init__(self, detector, parameters):
+        # An Essentia detector run over one channel arriving in pieces: samples short of a whole frame are held back
+        # for the next piece, and frames are counted from the start of the stream
+        self.detector = detector(**parameters)
+        self.frame_size, self.hop_size = parameters['frameSize'], parameters['hopSize']
+        self.pending = np.empty(0, dtype=np.float32)
+        self.frame_index = 0
+
+    def frames(self, samples):
+        # (frame index, frame) over the held back samples followed by `samples`, framed as FrameGenerator does
+        pending = np.concatenate([self.pending, samples])
+        start = 0
+        while start + self.frame_size <= len(pending):
+            yield self.frame_index, pending[start:start + self.frame_size]
+            start += self.hop_size
+            self.frame_index += 1
+
+        self.pending = pending[start:]
+
+
+class AudioSampleStream():
+    def __init__(self, channels, start_time=0, gap_detection=True, discontinuity_detection=True, click_detection=False):
+        # Detector state over the consecutive segments of one recording, so an event over a segment boundary is seen
+        # whole and detections are timed (s) from the stream's `start_time`
+        self.channels = channels
+        self.start_time = start_time
+        self.enabled = (gap_detection, discontinuity_detection, click_detection)
+        self.length = 0                 # samples analysed
+        self.last_capture_ns = None     # capture time of the last audio chunk analysed, for segments with sidecars
+
+        self.gaps = [DetectorStream(GapsDetector, GAP_PARAMETERS) for _ in range(channels)] if gap_detection else None
+        self.discontinuities = [DetectorStream(DiscontinuityDetector, DISCONTINUITY_PARAMETERS) for _ in range(channels)] if discontinuity_detection else None
+        self.clicks = [DetectorStream(ClickDetector, CLICK_PARAMETERS) for _ in range(channels)] if click_detection else None
+
+    def overlap(self, length, start_time=0, capture_times=None):
+        # Samples at the start of a segment of `length` samples that have already been analysed, or None if the
+        # segment does not follow on from the stream. Chunks are matched by capture time where both segments have
+        # them, otherwise the segment's start time is placed on the stream. Without either, segments are assumed
+        # to follow on without overlapping.
+        if capture_times is not None and self.last_capture_ns is not None:
+            capture_ns, samples_per_timestamp = capture_times
+            repeated = int(np.searchsorted(capture_ns, self.last_capture_ns, 'right'))
+            period_ns = samples_per_timestamp / SAMPLE_RATE * 1e9
+            if repeated == 0 and capture_ns[0] - self.last_capture_ns > 1.5 * period_ns:
+                return None
+
+            return min(repeated * samples_per_timestamp, length)
+
+        if start_time != 0 and self.start_time != 0:
+            overlap = self.length - round((start_time - self.start_time).total_seconds() * SAMPLE_RATE)
+            if overlap < -STREAM_TOLERANCE_S * SAMPLE_RATE:
+                return None
+
+            return min(max(overlap, 0), length)
+
+        return 0
+
+    def analyse(self, normalised_blocks):
+        # Raw detections (s from the stream start) completed by the (channels, samples) blocks that continue the stream
+        detections = {
+            'gaps': ([], []) if self.gaps is not None else None,
+            'discontinuities': [] if self.discontinuities is not None else None,
+            'clicks': [] if self.clicks is not None else None
+        }
+
+        for normalised_audio in normalised_blocks:
+            for channel, samples in enumerate(normalised_audio):
+                if self.gaps is not None:
+                    for _, frame in self.gaps[channel].frames(samples):
+                        frame_starts, frame_ends = self.gaps[channel].detector(frame)
+                        detections['gaps'][0].extend(frame_starts)
+                        detections['gaps'][1].extend(frame_ends)
+
+                if self.discontinuities is not None:
+                    stream = self.discontinuities[channel]
+                    for frame_index, frame in stream.frames(samples):
+                        # Locations are sample indices within the frame
+                        discont_starts, discont_amplitudes = stream.detector(frame)
+                        detections['discontinuities'].extend((frame_index * stream.hop_size + np.asarray(discont_starts)) / SAMPLE_RATE)
+
+                if self.clicks is not None:
+                    for _, frame in self.clicks[channel].frames(samples):
+                        frame_starts, frame_ends = self.clicks[channel].detector(frame)
+                        detections['clicks'].extend(np.mean([frame_starts, frame_ends], axis=0))
+
+            self.length += normalised_audio.shape[1]
+
+        return detections
+
 
 class AudioDetector():
+    # Detectors run as Essentia's standard algorithms a frame at a time. An `essentia.streaming` network is not used:
+    # its detectors re-emit earlier detections on frames without any, and it measured slower than per-frame calls.
     def __init__(self):
         self.gaps = []
         self.clicks = []
 
-    def process(self, audio: np.ndarray, start_time=0, gap_detection=True, discontinuity_detection=True, click_detection=False):
+        # Detector state carried between segments by `process_stream`
+        self.stream = None
+
+    def process(self, audio: np.ndarray, start_time=0, gap_detection=True, discontinuity_detection=True, click_detection=False, peak=None, time_offset=0):
+        # `peak` normalises audio that is part of a longer recording by the whole recording's peak, and `time_offset`
+        # (s) places the detections on that recording's timeline
+        detections = self.raw_detection(self.normalise(audio, peak), gap_detection, discontinuity_detection, click_detection)
+        return self.format_detections(self.offset_detections(detections, time_offset), start_time)
+
+    def process_chunks(self, chunks, start_time=0, gap_detection=True, discontinuity_detection=True, click_detection=False, peak=None):
+        # Detection over a long recording a chunk at a time, e.g. from `WavReader.chunks`, so only one chunk's float
+        # copy exists at once (pass the recording's `peak` so every chunk is normalised alike). The chunks run through
+        # one AudioSampleStream, so the detectors carry their state over chunk boundaries and an event across one is
+        # reported once and whole.
+        chunks = iter(chunks)
+        first_chunk = next(chunks, None)
+        channels = first_chunk.shape[0] if first_chunk is not None else 0
+
+        stream = AudioSampleStream(channels, start_time, gap_detection, discontinuity_detection, click_detection)
+        detections = stream.analyse(self.normalise(audio, peak) for audio in itertools.chain([first_chunk] if first_chunk is not None else [], chunks))
+
+        return self.format_detections(detections, start_time)
+
+    def process_stream(self, audio: np.ndarray, start_time=0, capture_times=None, gap_detection=True, discontinuity_detection=True, click_detection=False, peak=None):
+        # Detection over consecutive, overlapping segments of one recording, each analysed carrying on from the
+        # detector state the last one left. The overlap already analysed is skipped (by capture times, else by the
+        # segment's start time) and detections are timed from the start of the stream, so events over a segment
+        # boundary are reported once and whole. A segment that does not follow on starts a new stream. Audio is
+        # normalised by a fixed `peak` (full scale of the sample type by default), so its level does not step
+        # between segments.
+        enabled = (gap_detection, discontinuity_detection, click_detection)
+        overlap = None
+        if self.stream is not None and self.stream.enabled == enabled and self.stream.channels == audio.shape[0]:
+            overlap = self.stream.overlap(audio.shape[1], start_time, capture_times)
+
+        if overlap is None:
+            self.stream = AudioSampleStream(audio.shape[0], start_time, *enabled)
+            overlap = 0
+
+        peak = self.full_scale(audio) if peak is None else peak
+        detections = self.stream.analyse(
+            self.normalise(audio[:, block_start:block_start + STREAM_BLOCK_LENGTH], peak)
+            for block_start in range(overlap, audio.shape[1], STREAM_BLOCK_LENGTH)
+        )
+
+        if capture_times is not None and len(capture_times[0]) > 0:
+            self.stream.last_capture_ns = capture_times[0][-1]
+
+        return self.format_detections(detections, self.stream.start_time)
+
+    def reset_stream(self):
+        self.stream = None
+
+    @staticmethod
+    def full_scale(audio):
+        # Largest magnitude the sample type can hold (1 for float audio)
+        return np.iinfo(audio.dtype).max + 1 if np.issubdtype(audio.dtype, np.integer) else 1.0
+
+    @staticmethod
+    def normalise(audio, peak=None):
         # Normalise audio to the range [-1, 1]
-        normalised_audio = audio / np.max(np.abs(audio))
-        normalised_audio = normalised_audio.astype(np.float32)
+        normalised_audio = audio / (np.max(np.abs(audio)) if peak is None else peak)
+        return normalised_audio.astype(np.float32)
+
+    @staticmethod
+    def offset_detections(detections, time_offset=0):
+        # Shift raw detections (s) by `time_offset`
+        if time_offset == 0:
+            return detections
+
+        offset = lambda times: [t + time_offset for t in times]
+        return {
+            'gaps': (offset(detections['gaps'][0]), offset(detections['gaps'][1])) if detections['gaps'] is not None else None,
+            'discontinuities': offset(detections['discontinuities']) if detections['discontinuities'] is not None else None,
+            'clicks': offset(detections['clicks']) if detections['clicks'] is not None else None
+        }
+
+    def format_detections(self, detections, start_time=0):
         gaps, clicks, discontinuities = [], [], []
 
-        if gap_detection:
-            gaps = self.audio_gap_detection(normalised_audio, start_time)
+        if detections['gaps'] is not None:
+            gaps = self.format_gaps(*detections['gaps'], start_time)
             self.gaps.extend(gaps)
 
-        if discontinuity_detection:
-            discontinuities = self.audio_discontinuity_detection(normalised_audio, start_time)
+        if detections['discontinuities'] is not None:
+            discontinuities = self.format_times(detections['discontinuities'], start_time)
             self.clicks.extend(discontinuities)
 
-        if click_detection:
-            clicks = self.audio_click_detection(normalised_audio, start_time)
+        if detections['clicks'] is not None:
+            clicks = self.format_times(detections['clicks'], start_time)
             self.clicks.extend(clicks)
 
         return {
@@ -32,33 +225,18 @@ class AudioDetector():
             'clicks': clicks
         }
 
-    @staticmethod
-    def audio_gap_detection(audio_values, start_time=0):
-        """Detection of gaps (silences) in the audio signal"""
-        # Parameters
-        frame_size = 1024         # frame size used for the analysis
-        hop_size = 512            # hop size used for the analysis
-        minimum_time = 10         # time of the minimum gap duration [ms]
-        prepower_threshold = -38  # prepower threshold [dB]
-        silence_threshold = -45   # silence threshold [dB]
-
-        # Detection process
-        detected_gap_starts, detected_gap_ends = [], []
-        gapDetector = GapsDetector(
-            frameSize=frame_size, hopSize=hop_size, minimumTime=minimum_time,
-            prepowerThreshold=prepower_threshold, silenceThreshold=silence_threshold
-        )
-
-        for audio_channel in audio_values:
-            for frame in tqdm(FrameGenerator(audio_channel, frameSize=frame_size, hopSize=hop_size, startFromZero=True)):
-                frame_starts, frame_ends = gapDetector(frame)
-                detected_gap_starts.extend(frame_starts)
-                detected_gap_ends.extend(frame_ends)
-
-            gapDetector.reset()
+    def raw_detection(self, normalised_audio, gap_detection=True, discontinuity_detection=True, click_detection=False):
+        # Detections in seconds from the start of the audio (None for detectors not run), before formatting
+        return {
+            'gaps': self.detect_gaps(normalised_audio) if gap_detection else None,
+            'discontinuities': self.detect_discontinuities(normalised_audio) if discontinuity_detection else None,
+            'clicks': self.detect_clicks(normalised_audio) if click_detection else None
+        }
 
-        detected_gap_starts = np.unique(np.round(detected_gap_starts, decimals=2))
-        detected_gap_ends = np.unique(np.round(detected_gap_ends, decimals=2))
+    @staticmethod
+    def format_gaps(gap_starts, gap_ends, start_time=0):
+        detected_gap_starts = np.unique(np.round(gap_starts, decimals=2))
+        detected_gap_ends = np.unique(np.round(gap_ends, decimals=2))
         detected_gaps = zip(detected_gap_starts, detected_gap_ends)
         output = []
 
@@ -74,62 +252,84 @@ class AudioDetector():
         return output
 
     @staticmethod
-    def audio_discontinuity_detection(audio_values, start_time=0):
+    def format_times(detected_times, start_time=0):
+        detected_times = np.unique(np.round(detected_times, decimals=2))
+        output = []
+
+        if start_time != 0:
+            for detected_time in detected_times:
+                output.append(start_time + datetime.timedelta(seconds=float(detected_time)))
+
+        return output
+
+    @classmethod
+    def audio_gap_detection(cls, audio_values, start_time=0):
+        """Detection of gaps (silences) in the audio signal"""
+        return cls.format_gaps(*cls.detect_gaps(audio_values), start_time)
+
+    @classmethod
+    def audio_discontinuity_detection(cls, audio_values, start_time=0):
         """Detection of discontinuities in the audio signal"""
-        # Parameters
-        frame_size = 512          # frame size used for the analysis
-        hop_size = 256            # hop size used for the analysis
-        detection_threshold = 8   # threshold is T * s.d. + median
-        energy_threshold = -60    # detect silent subframes [dB]
-        silence_threshold = -50   # skip silent frames [dB]
+        return cls.format_times(cls.detect_discontinuities(audio_values), start_time)
+
+    @classmethod
+    def audio_click_detection(cls, audio_values, start_time=0):
+        """Detection of clicks in the audio signal"""
+        return cls.format_times(cls.detect_clicks(audio_values), start_time)
+
+    @staticmethod
+    def detect_gaps(audio_values):
+        """Raw gap start and end times (s) over every channel"""
+        frame_size, hop_size = GAP_PARAMETERS['frameSize'], GAP_PARAMETERS['hopSize']
+
+        # Detection process
+        detected_gap_starts, detected_gap_ends = [], []
+        gapDetector = GapsDetector(**GAP_PARAMETERS)
+
+        for audio_channel in audio_values:
+            for frame in FrameGenerator(audio_channel, frameSize=frame_size, hopSize=hop_size, startFromZero=True):
+                frame_starts, frame_ends = gapDetector(frame)
+                detected_gap_starts.extend(frame_starts)
+                detected_gap_ends.extend(frame_ends)
+
+            gapDetector.reset()
+
+        return detected_gap_starts, detected_gap_ends
+
+    @staticmethod
+    def detect_discontinuities(audio_values):
+        """Raw discontinuity times (s) over every channel"""
+        frame_size, hop_size = DISCONTINUITY_PARAMETERS['frameSize'], DISCONTINUITY_PARAMETERS['hopSize']
 
         # Detection process
         detected_discontinuities = []
-        discontinuityDetector = DiscontinuityDetector(
-            detectionThreshold=detection_threshold,
-            energyThreshold=energy_threshold, silenceThreshold=silence_threshold,
-            frameSize=frame_size, hopSize=hop_size
-        )
+        discontinuityDetector = DiscontinuityDetector(**DISCONTINUITY_PARAMETERS)
 
         for audio_channel in audio_values:
-            for frame in tqdm(FrameGenerator(audio_channel, frameSize=frame_size, hopSize=hop_size, startFromZero=True)):
+            for frame_index, frame in enumerate(FrameGenerator(audio_channel, frameSize=frame_size, hopSize=hop_size, startFromZero=True)):
+                # Locations are sample indices within the frame
                 discont_starts, discont_amplitudes = discontinuityDetector(frame)
-                detected_discontinuities.extend(discont_starts)
+                detected_discontinuities.extend((frame_index * hop_size + np.asarray(discont_starts)) / SAMPLE_RATE)
 
             discontinuityDetector.reset()
 
-        detected_discontinuities = np.unique(np.round(detected_discontinuities, decimals=2))
-        output = []
-
-        if start_time != 0:
-            for discontinuity in detected_discontinuities:
-                output.append(start_time + datetime.timedelta(seconds=float(discontinuity)))
-
-        return output
+        return detected_discontinuities
 
     @staticmethod
-    def audio_click_detection(audio_values, start_time=0):
-        """Detection of clicks in the audio signal"""
-        # Parameters
-        frame_size = 512          # frame size used for the analysis
-        hop_size = 256            # hop size used for the analysis
+    def detect_clicks(audio_values):
+        """Raw click times (s, midpoint of each click) over every channel"""
+        frame_size, hop_size = CLICK_PARAMETERS['frameSize'], CLICK_PARAMETERS['hopSize']
 
         # Detection process
         detected_clicks = []
-        clickDetector = ClickDetector(frameSize=frame_size, hopSize=hop_size)
+        clickDetector = ClickDetector(**CLICK_PARAMETERS)
 
         for audio_channel in audio_values:
-            for frame in tqdm(FrameGenerator(audio_channel, frameSize=frame_size, hopSize=hop_size, startFromZero=True)):
+            for frame in FrameGenerator(audio_channel, frameSize=frame_size, hopSize=hop_size, startFromZero=True):
                 frame_starts, frame_ends = clickDetector(frame)
                 detected_clicks.extend(np.mean([frame_starts, frame_ends], axis=0))
 
             clickDetector.reset()
 
-        detected_clicks = np.unique(np.round(detected_clicks, decimals=2))
-        output = []
-
-        if start_time != 0:
-            for click in detected_clicks:
-                output.append(start_time + datetime.timedelta(seconds=float(click)))
+        return detected_clicks
 
-        return output
@@ -97,13 +97,12 @@ def setup_models(text_prompts, opt, aesthetic_clip_len, technical_num_clips, dev
     return text_encoder, visual_encoder, temporal_samplers, maxvqa
 
 
-def extract_video_features(video, encoder, opt, temporal_samplers, use_aesthetic_features=False, device='cpu'):
+def extract_video_features(video, encoder, opt, temporal_samplers, use_aesthetic_features=False, device='cpu', frame_indices=None, decoded_indices=None):
     # Video preprocessing module
     mean = torch.FloatTensor([123.675, 116.28, 103.53]).to(device).reshape(-1,1,1,1)
     std = torch.FloatTensor([58.395, 57.12, 57.375]).to(device).reshape(-1,1,1,1)
 
-    sample_feature_type = {"technical": opt["inference"]["args"]["sample_types"]["technical"]}
-    video_data, frame_idx = spatial_temporal_view_decomposition(video, sample_feature_type, temporal_samplers, device=device)
+    video_data, frame_idx = sample_video_view(video, opt, temporal_samplers, device, frame_indices, decoded_indices)
 
     # Assuming that video_data is the preprocessed video from above step
     if use_aesthetic_features:
@@ -120,20 +119,36 @@ def extract_video_features(video, encoder, opt, temporal_samplers, use_aesthetic
     return vis_feats, frame_idx["technical"][0::2]
 
 
+def sample_video_view(video, opt, temporal_samplers, device='cpu', frame_indices=None, decoded_indices=None):
+    # Technical (fragment) view of a video, (C, T, H, W) with T = clip_len * num_clips, before normalisation
+    sample_feature_type = {"technical": opt["inference"]["args"]["sample_types"]["technical"]}
+    return spatial_temporal_view_decomposition(
+        video, sample_feature_type, temporal_samplers, device=device,
+        frame_indices=frame_indices, decoded_indices=decoded_indices
+    )
+
+
 def spatial_temporal_view_decomposition(
-    vreader, sample_types, samplers, is_train=False, augment=False, device='cpu'
+    vreader, sample_types, samplers, is_train=False, augment=False, device='cpu', frame_indices=None, decoded_indices=None
 ):
+    # `vreader` is either the whole video, or (with `decoded_indices`) only the frames at those (sorted) indices of
+    # the video, decoded ahead of time for the sampled `frame_indices`
     video = {}
 
     all_frame_inds = []
     frame_inds = {}
     for stype in samplers:
-        frame_inds[stype] = samplers[stype](len(vreader), is_train)
+        frame_inds[stype] = frame_indices if frame_indices is not None else samplers[stype](len(vreader), is_train)
         all_frame_inds.append(frame_inds[stype])
 
     ### Each frame is only decoded one time!!!
     all_frame_inds = np.concatenate(all_frame_inds, 0)
-    frame_dict = {idx: vreader[idx] for idx in np.unique(all_frame_inds)}
+    if decoded_indices is None:
+        frame_dict = {idx: vreader[idx] for idx in np.unique(all_frame_inds)}
+    else:
+        # Frames missing from the decode (e.g. beyond a short segment's real end) fall back to the nearest later one
+        positions = np.minimum(np.searchsorted(decoded_indices, np.unique(all_frame_inds)), len(decoded_indices) - 1)
+        frame_dict = {idx: vreader[position] for idx, position in zip(np.unique(all_frame_inds), positions)}
 
     for stype in samplers:
         imgs = [frame_dict[idx] for idx in frame_inds[stype]]
@@ -170,20 +185,93 @@ class VideoDetector():
             device=self.device
         )
 
-    def process(self, video=None):
+    def sample_frame_indices(self, frame_count):
+        # Frame indices the technical sampler selects from a video of `frame_count` frames (random on every call),
+        # so only those frames need decoding
+        return self.temporal_samplers["technical"](frame_count, False)
+
+    def process(self, video=None, frame_indices=None, decoded_indices=None):
+        # With `frame_indices` (from `sample_frame_indices`), `video` need only hold the frames at `decoded_indices`
         video = torch.Tensor(video).to(self.device)
-        features = self.feature_extraction(video)
+        features = self.feature_extraction(video, frame_indices, decoded_indices)
         results = self.predict(features)
         return results
 
-    def feature_extraction(self, video_frames=None):
+    def process_batch(self, videos, frame_indices=None, decoded_indices=None, epochs=1):
+        # One forward pass over `epochs` sampled views of each of several videos (e.g. segments or rigs), returning
+        # per video a list of each epoch's output as `process` would give it. Each video is converted to a tensor
+        # once and only re-sampled per epoch. `frame_indices`, if given, holds per video the indices of every epoch.
+        frame_indices = frame_indices if frame_indices is not None else [None] * len(videos)
+        decoded_indices = decoded_indices if decoded_indices is not None else [None] * len(videos)
+
+        views = []
+        for video, video_frame_indices, video_decoded_indices in zip(videos, frame_indices, decoded_indices):
+            video = torch.Tensor(video).to(self.device)
+            for i in range(epochs):
+                epoch_frame_indices = video_frame_indices[i] if video_frame_indices is not None else None
+                views.append(self.technical_view(video, epoch_frame_indices, video_decoded_indices))
+
+        outputs = [[view_outputs] for view_outputs in self.predict_views(views)]
+        return [outputs[i:i + epochs] for i in range(0, len(outputs), epochs)]
+
+    def batched_epochs_match(self, video, frame_indices, decoded_indices=None, atol=1e-5):
+        # Whether `process_batch` gives the same outputs for a video's epochs as a `process` call per epoch
+        return self.batch_matches([video], [frame_indices], [decoded_indices], epochs=len(frame_indices), atol=atol)
+
+    def batch_matches(self, videos, frame_indices=None, decoded_indices=None, epochs=1, atol=1e-5):
+        # Whether `process_batch` gives the same outputs for several videos' epochs as a `process` call per video and
+        # epoch, both run from the same random state (fragment crops are random) with the same sampled frame indices.
+        # Indices are sampled here for videos without them, as the temporal sampler is random too.
+        frame_indices = frame_indices if frame_indices is not None else [None] * len(videos)
+        decoded_indices = decoded_indices if decoded_indices is not None else [None] * len(videos)
+        frame_indices = [
+            video_frame_indices if video_frame_indices is not None else [self.sample_frame_indices(len(video)) for _ in range(epochs)]
+            for video, video_frame_indices in zip(videos, frame_indices)
+        ]
+
+        devices = [self.device.index or 0] if self.device.type == 'cuda' else []
+        with torch.random.fork_rng(devices=devices):
+            batched = self.process_batch(videos, frame_indices, decoded_indices, epochs=epochs)
+        with torch.random.fork_rng(devices=devices):
+            separate = [
+                [self.process(video, video_frame_indices[i], video_decoded_indices) for i in range(epochs)]
+                for video, video_frame_indices, video_decoded_indices in zip(videos, frame_indices, decoded_indices)
+            ]
+
+        return all(
+            batched_output.shape == separate_output.shape and torch.allclose(batched_output, separate_output, atol=atol)
+            for batched_video, separate_video in zip(batched, separate)
+            for batched_epoch, separate_epoch in zip(batched_video, separate_video)
+            for batched_output, separate_output in zip(batched_epoch, separate_epoch)
+        )
+
+    def technical_view(self, video, frame_indices=None, decoded_indices=None):
+        # Normalised technical view of a video tensor, (C, T, H, W)
+        mean = torch.FloatTensor([123.675, 116.28, 103.53]).to(self.device).reshape(-1,1,1,1)
+        std = torch.FloatTensor([58.395, 57.12, 57.375]).to(self.device).reshape(-1,1,1,1)
+
+        video_data, _ = sample_video_view(video, self.opt, self.temporal_samplers, self.device, frame_indices, decoded_indices)
+        return (video_data["technical"] - mean) / std
+
+    def predict_views(self, views):
+        # Views are stacked on a new leading batch dim, which the encoder keeps through its `-1` reshapes, and the
+        # local outputs split back along it (each keeping the batch dim of 1 `process` gives them)
+        with torch.no_grad():
+            features = self.visual_encoder(torch.stack(views, 0).to(self.device))
+
+        raw_outputs = self.predict(features)[0]
+        return torch.chunk(raw_outputs, len(views), dim=0)
+
+    def feature_extraction(self, video_frames=None, frame_indices=None, decoded_indices=None):
         # Extract features from test video
         vis_feats, sampled_frames = extract_video_features(
             video_frames,
             self.visual_encoder,
             self.opt,
             self.temporal_samplers,
-            device=self.device
+            device=self.device,
+            frame_indices=frame_indices,
+            decoded_indices=decoded_indices
         )
 
         return vis_feats
@@ -1,4 +1,5 @@
 import os
+import sys
 import cv2
 import json
 import math
@@ -13,24 +14,65 @@ from time import time as timer
 import matplotlib.pyplot as plt
 import matplotlib.colors as mcolors
 from itertools import cycle
+from concurrent.futures import ThreadPoolExecutor
 
 from EssentiaAudioDetector import AudioDetector
 from MaxVQAVideoDetector import VideoDetector
+from AudioAnalysisExecutor import AudioAnalysisExecutor
+from WavReader import WavReader
+from ContainerReader import ContainerReader
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'capture'))
+from IndexedSegment import IndexedSegmentReader
+from TimelineStore import TimelineStore
 
 Object = lambda **kwargs: type('Object', (), kwargs)
 
+# Audio plots draw the signal as a min/max envelope over at most this many buckets of samples
+AUDIO_PLOT_BUCKETS = 4000
+
 
 class StutterDetection():
-    def __init__(self, video_downsample_frames=64, audio_fps=44100, device='cpu'):
+    def __init__(self, video_downsample_frames=64, audio_fps=44100, device='cpu', sampled_decode=True, decode_size=None, timeline_path=None, audio_workers=0, audio_window=None, audio_chunk_s=None, audio_stream=False, batched_epochs=False):
         self.audio_detector = AudioDetector()
         self.video_detector = VideoDetector(frames=video_downsample_frames, device=device)
         self.audio_detection_results = []
-        self.video_detection_results = np.array([[]]*16)
+        self.video_detection_results = TimelineStore(rows=16, spill_path=timeline_path)
         self.audio_fps = audio_fps
         self.audio_segment_index = 0
         self.video_segment_index = 0
 
-    def process(self, directory_path, truth=None, audio_detection=True, video_detection=True, plot=True, time_indexed_files=True, inference_epochs=1, output_directory='./'):
+        # Decode only the frames the video detector samples, optionally shrunk to `decode_size` (shortest side, px)
+        self.sampled_decode = sampled_decode
+        self.decode_size = decode_size
+
+        # Run a segment's inference epochs through the encoder as one batch, once checked on the first segment to
+        # match a pass per epoch (None until checked)
+        self.batched_epochs = batched_epochs
+        self.batched_epochs_match = None
+
+        # Segments of a batch share a forward pass once checked (on the first batch) to match a pass per segment, as
+        # the batch dim has to survive the encoder's reshapes (None until checked)
+        self.batched_segments_match = None
+
+        # WAV files longer than `audio_chunk_s` are memory-mapped and analysed in chunks rather than loaded whole
+        self.audio_chunk_s = audio_chunk_s
+
+        # Audio detection spread over a pool of processes by (segment, channel, detector), if any workers. The pool
+        # is started for each run and given the audio of the `audio_window` segments ahead of the one being loaded
+        # (twice the workers by default), whatever the video batch size.
+        self.audio_workers = audio_workers
+        self.audio_window = audio_window if audio_window is not None else 2 * audio_workers
+        self.audio_executor = None
+        self.audio_submissions = {}
+
+        # Audio detection carrying detector state from each segment to the next, skipping the overlap between them
+        # (segments are then analysed in order on one thread, so this cannot be spread over processes)
+        if audio_stream and audio_workers > 0:
+            raise ValueError("Streamed audio detection cannot be spread over audio workers")
+        self.audio_stream = audio_stream
+
+    def process(self, directory_path, truth=None, audio_detection=True, video_detection=True, plot=True, time_indexed_files=True, inference_epochs=1, output_directory='./', pipelined=False, batch_size=1):
         if os.path.isfile(directory_path):
             # Permits running on single input file
             if directory_path.endswith(".mp4"):
@@ -40,6 +82,9 @@ class StutterDetection():
             elif directory_path.endswith(".wav"):
                 audio_segment_paths = [directory_path]
                 video_segment_paths = []
+            elif directory_path.endswith(".mjpeg"):
+                audio_segment_paths = []
+                video_segment_paths = [directory_path]
             else:
                 exit(1)
         elif os.path.isdir(directory_path):
@@ -49,72 +94,36 @@ class StutterDetection():
             exit(1)
 
         # Cycle through each AV file running detection algorithms
-        for index in range(max(len(audio_segment_paths), len(video_segment_paths))):
-            # Run audio detection
-            if audio_detection and index < len(audio_segment_paths):
-                audio_path = audio_segment_paths[index]
-                audio_file_name = os.path.basename(audio_path)
-                audio_segment = self.get_local_audio(audio_path)
-                print(f"New audio segment: {audio_file_name} {audio_segment.shape}")
-
-                if time_indexed_files:
-                    timestamps = [datetime.strptime(f, '%H:%M:%S.%f') for f in audio_path.split('/')[-1].replace('.wav', '').split('_')[1:]]
-
-                    results = self.audio_detection(
-                        audio_segment,
-                        time_indexed_audio=time_indexed_files,
-                        plot=plot,
-                        audio_fname=audio_file_name,
-                        start_time=timestamps[0],
-                        end_time=timestamps[-1],
-                        output_dir=output_directory
-                    )
-                else:
-                    results = self.audio_detection(
-                        audio_segment,
-                        time_indexed_audio=time_indexed_files,
-                        plot=plot,
-                        audio_fname=audio_file_name,
-                        output_dir=output_directory
-                    )
-
-                self.audio_detection_results.append(results)
-                self.audio_segment_index += 1
-
-            # Run video detection
-            if video_detection and index < len(video_segment_paths):
-                video_path = video_segment_paths[index]
-                video_segment = self.get_local_video(video_path)
-                print(f"New video segment: {video_path.split('/')[-1]} {video_segment.shape}")
-
-                if time_indexed_files:
-                    timestamps = [datetime.strptime(f, '%H:%M:%S.%f') for f in video_path.split('/')[-1].replace('.mp4', '').split('_')[1:]]
-
-                    results = self.video_detection(
-                        video_segment,
-                        plot=plot,
-                        start_time=timestamps[0],
-                        end_time=timestamps[-1],
-                        epochs=inference_epochs,
-                        output_dir=output_directory
-                    )
-                else:
-                    results = self.video_detection(
-                        video_segment,
-                        plot=plot,
-                        epochs=inference_epochs,
-                        output_dir=output_directory
-                    )
-
-                # Add local detection results to global results timeline (compensating for segment overlap)
-                self.video_detection_results = np.append(self.video_detection_results, results[:, :math.ceil(results.shape[1] * 0.9)], axis=1)
-                self.video_segment_index += 1
+        segment_count = max(len(audio_segment_paths) if audio_detection else 0, len(video_segment_paths) if video_detection else 0)
+        # Segments are loaded and detected in batches of `batch_size`, the video of a batch sharing forward passes
+        load_segment = lambda index: self.load_segment(index, audio_segment_paths, video_segment_paths, audio_detection, video_detection, time_indexed_files, inference_epochs)
+        load_batch = lambda start: [load_segment(index) for index in range(start, min(start + batch_size, segment_count))]
+        batch_starts = range(0, segment_count, batch_size)
+        processing_time_start = timer()
+
+        self.audio_executor = AudioAnalysisExecutor(self.audio_workers) if self.audio_workers > 0 and audio_detection else None
+        try:
+            if pipelined:
+                self.process_pipelined(batch_starts, load_batch, plot, time_indexed_files, inference_epochs, output_directory)
+            else:
+                for batch_start in batch_starts:
+                    self.detect_segments(load_batch(batch_start), plot, time_indexed_files, inference_epochs, output_directory)
+        finally:
+            if self.audio_executor is not None:
+                self.audio_executor.shutdown()
+                self.audio_executor = None
+            self.audio_submissions.clear()
+
+        processing_time = timer() - processing_time_start
+        if segment_count > 0:
+            print(f"Processed {segment_count} segments in {processing_time:.2f}s ({60 * segment_count / processing_time:.2f} segments/min)")
 
         # If recording timed segments, plot global video detection results over all clips in timeline
         if time_indexed_files and video_on and len(video_segment_paths) != 0:
-            global_start_time = datetime.strptime(video_segment_paths[0].split('/')[-1].replace('.mp4', '').split('_')[1], '%H:%M:%S.%f')
-            global_end_time = timestamps[-1]
+            global_start_time = datetime.strptime(os.path.splitext(video_segment_paths[0].split('/')[-1])[0].split('_')[1], '%H:%M:%S.%f')
+            global_end_time = self.segment_times(video_segment_paths[-1])[-1]
             print(f"Full timeline: {global_start_time.strftime('%H:%M:%S.%f')} => {global_end_time.strftime('%H:%M:%S.%f')}")
+            self.video_detection_results.flush()
             self.plot_local_vqa(
                 self.video_detection_results,
                 true_time_labels=truth,
@@ -124,6 +133,249 @@ class StutterDetection():
                 output_file="motion-timeline.png"
             )
 
+    def process_pipelined(self, batch_starts, load_batch, plot, time_indexed_files, inference_epochs, output_directory):
+        # Batch N+1 is read and decoded, and batch N's audio detection run, on worker threads while batch N's video
+        # inference runs here. Results are reported (and plotted) from this thread only, in segment order.
+        with ThreadPoolExecutor(max_workers=2, thread_name_prefix='detection') as executor:
+            loading = executor.submit(load_batch, batch_starts[0]) if len(batch_starts) > 0 else None
+
+            for position in range(len(batch_starts)):
+                segments = loading.result()
+                if position + 1 < len(batch_starts):
+                    loading = executor.submit(load_batch, batch_starts[position + 1])
+
+                self.detect_segments(segments, plot, time_indexed_files, inference_epochs, output_directory, executor)
+
+    def detect_segments(self, segments, plot, time_indexed_files, inference_epochs, output_directory, executor=None):
+        # Detection over a batch of loaded segments. With an `executor`, audio detection runs on it alongside the
+        # batch's video inference (on the audio process pool instead if there is one). `audio_results` holds a
+        # callable per segment that waits for its detections.
+        audio_results = [None] * len(segments)
+        if self.audio_executor is not None:
+            audio_results = [segment['audio']['analysis'].result if 'audio' in segment else None for segment in segments]
+        elif executor is not None and self.audio_stream:
+            # Streamed segments are analysed in order, one after another, so the batch's audio is a single task
+            stream_detection = executor.submit(lambda: [
+                self.run_audio_detector(
+                    segment['audio']['samples'],
+                    start_time=segment['audio']['start_time'],
+                    capture_times=self.get_capture_times(segment['audio']['path'])
+                ) if 'audio' in segment else None for segment in segments
+            ])
+            audio_results = [lambda position=position: stream_detection.result()[position] for position in range(len(segments))]
+        elif executor is not None:
+            audio_results = [
+                executor.submit(self.run_audio_detector, segment['audio']['samples'], start_time=segment['audio']['start_time']).result
+                if 'audio' in segment else None for segment in segments
+            ]
+
+        video_segments = [segment['video'] for segment in segments if 'video' in segment]
+        if executor is not None or len(video_segments) > 1:
+            video_inferences = iter(self.infer_video_batch(video_segments, inference_epochs))
+        else:
+            video_inferences = iter([None] * len(video_segments))
+
+        for segment, audio_result in zip(segments, audio_results):
+            if 'audio' in segment:
+                self.detect_audio_segment(segment['audio'], plot, time_indexed_files, output_directory, audio_result() if audio_result is not None else None)
+            if 'video' in segment:
+                self.detect_video_segment(segment['video'], plot, time_indexed_files, inference_epochs, output_directory, next(video_inferences))
+
+    def load_segment(self, index, audio_segment_paths, video_segment_paths, audio_detection=True, video_detection=True, time_indexed_files=True, inference_epochs=1):
+        # Read and decode the audio and video of one segment index, ready for detection
+        segment = {}
+        audio_path = audio_segment_paths[index] if audio_detection and index < len(audio_segment_paths) else None
+        video_path = video_segment_paths[index] if video_detection and index < len(video_segment_paths) else None
+
+        # Audio already submitted to the process pool was loaded ahead of the segment
+        audio_analysis = None
+        if self.audio_executor is not None and audio_path is not None:
+            self.submit_audio_window(index, audio_segment_paths, time_indexed_files)
+            audio_content, audio_analysis = self.audio_submissions.pop(index)
+            frames, sampling = self.get_sampled_local_video(video_path, inference_epochs) if video_path is not None else (None, None)
+
+        # Both streams of a combined mp4 segment are demuxed from a single open of the container
+        elif audio_path is not None and audio_path == video_path and audio_path.endswith(".mp4"):
+            audio_content, (frames, sampling) = self.get_local_container(audio_path, inference_epochs)
+        else:
+            audio_content = self.get_local_audio(audio_path) if audio_path is not None else None
+            frames, sampling = self.get_sampled_local_video(video_path, inference_epochs) if video_path is not None else (None, None)
+
+        if audio_path is not None:
+            timestamps = self.segment_times(audio_path) if time_indexed_files else None
+            segment['audio'] = {
+                'path': audio_path,
+                'samples': audio_content,
+                'analysis': audio_analysis,
+                'start_time': timestamps[0] if timestamps else 0,
+                'end_time': timestamps[-1] if timestamps else 0
+            }
+
+        if video_path is not None:
+            timestamps = self.segment_times(video_path) if time_indexed_files else None
+            segment['video'] = {
+                'path': video_path,
+                'frames': frames,
+                'sampling': sampling,
+                'start_time': timestamps[0] if timestamps else 0,
+                'end_time': timestamps[-1] if timestamps else 0
+            }
+
+        return segment
+
+    def submit_audio_window(self, index, audio_segment_paths, time_indexed_files=True):
+        # Load the audio of segments `index` onwards, up to `audio_window` of them, and submit any not yet submitted
+        for ahead in range(index, min(index + max(self.audio_window, 1), len(audio_segment_paths))):
+            if ahead in self.audio_submissions:
+                continue
+
+            audio_path = audio_segment_paths[ahead]
+            timestamps = self.segment_times(audio_path) if time_indexed_files else None
+            audio_content = self.get_local_audio(audio_path)
+            self.audio_submissions[ahead] = (
+                audio_content,
+                self.audio_executor.submit(self.audio_samples(audio_content), start_time=timestamps[0] if timestamps else 0)
+            )
+
+    @staticmethod
+    def segment_times(filename):
+        # Start and end times of a capture segment from its `<index>_<start>_<end>` file name
+        return [datetime.strptime(f, '%H:%M:%S.%f') for f in os.path.splitext(os.path.basename(filename))[0].split('_')[1:]]
+
+    def detect_audio_segment(self, audio_segment, plot, time_indexed_files, output_directory, audio_results=None):
+        audio_path = audio_segment['path']
+        audio_file_name = os.path.basename(audio_path)
+        print(f"New audio segment: {audio_file_name} {audio_segment['samples'].shape}")
+
+        # Streamed detection places overlapping segments by their capture times whether or not files are time indexed
+        capture_times = self.get_capture_times(audio_path) if time_indexed_files or self.audio_stream else None
+
+        if time_indexed_files:
+            results = self.audio_detection(
+                audio_segment['samples'],
+                time_indexed_audio=time_indexed_files,
+                plot=plot,
+                audio_fname=audio_file_name,
+                start_time=audio_segment['start_time'],
+                end_time=audio_segment['end_time'],
+                capture_times=capture_times,
+                capture_drops=self.get_capture_drops(audio_path),
+                output_dir=output_directory,
+                audio_results=audio_results
+            )
+        else:
+            results = self.audio_detection(
+                audio_segment['samples'],
+                time_indexed_audio=time_indexed_files,
+                plot=plot,
+                audio_fname=audio_file_name,
+                capture_times=capture_times,
+                output_dir=output_directory,
+                audio_results=audio_results
+            )
+
+        self.audio_detection_results.append(results)
+        self.audio_segment_index += 1
+
+    def detect_video_segment(self, video_segment, plot, time_indexed_files, inference_epochs, output_directory, video_inference=None):
+        video_path = video_segment['path']
+        print(f"New video segment: {os.path.basename(video_path)} {video_segment['frames'].shape}")
+        capture_times = None
+
+        if time_indexed_files:
+            capture_times = self.get_capture_times(video_path)
+            results = self.video_detection(
+                video_segment['frames'],
+                plot=plot,
+                start_time=video_segment['start_time'],
+                end_time=video_segment['end_time'],
+                epochs=inference_epochs,
+                capture_times=capture_times,
+                capture_drops=self.get_capture_drops(video_path),
+                output_dir=output_directory,
+                video_inference=video_inference,
+                **video_segment['sampling']
+            )
+        else:
+            results = self.video_detection(
+                video_segment['frames'],
+                plot=plot,
+                epochs=inference_epochs,
+                output_dir=output_directory,
+                video_inference=video_inference,
+                **video_segment['sampling']
+            )
+
+        self.add_to_timeline(
+            results,
+            start_time=video_segment['start_time'],
+            end_time=video_segment['end_time'],
+            capture_times=capture_times,
+            content_length=video_segment['sampling'].get('frame_count', len(video_segment['frames']))
+        )
+        self.video_segment_index += 1
+
+    def add_to_timeline(self, results, start_time=0, end_time=0, capture_times=None, content_length=None):
+        # Add local detection results to global results timeline (compensating for segment overlap), each column
+        # timed from the capture times if known, else spread evenly over the segment's time range
+        kept_columns = math.ceil(results.shape[1] * 0.9)
+        times = None
+
+        if start_time != 0 and end_time != 0:
+            if capture_times is not None:
+                time_offsets = self.capture_time_offsets(capture_times, content_length, results.shape[1])
+            else:
+                time_offsets = np.linspace(0, 1, results.shape[1]) * (end_time - start_time).total_seconds()
+
+            times = np.datetime64(start_time, 'ns').astype(np.int64) + np.round(time_offsets * 1e9).astype(np.int64)
+            times = times[:kept_columns]
+
+        self.video_detection_results.append(results[:, :kept_columns], times)
+
+    def process_segment(self, segments, plot=False, inference_epochs=1, output_directory='./'):
+        # Run detection over segments handed over in memory by the capture processor (no file round trip)
+        if 'audio' in segments:
+            audio_segment = segments['audio']
+            print(f"New audio segment: {audio_segment['index']} {audio_segment['samples'].shape}")
+
+            results = self.audio_detection(
+                audio_segment['samples'],
+                time_indexed_audio=True,
+                plot=plot,
+                start_time=audio_segment['start_time'],
+                end_time=audio_segment['end_time'],
+                capture_times=(audio_segment['timestamps'], audio_segment['samples_per_timestamp']),
+                capture_drops=audio_segment.get('dropped_ns'),
+                output_dir=output_directory
+            )
+
+            self.audio_detection_results.append(results)
+            self.audio_segment_index += 1
+
+        if 'video' in segments:
+            video_segment = segments['video']
+            print(f"New video segment: {video_segment['index']} {video_segment['frames'].shape}")
+
+            results = self.video_detection(
+                video_segment['frames'],
+                plot=plot,
+                start_time=video_segment['start_time'],
+                end_time=video_segment['end_time'],
+                epochs=inference_epochs,
+                capture_times=(video_segment['timestamps'], video_segment['samples_per_timestamp']),
+                capture_drops=video_segment.get('dropped_ns'),
+                output_dir=output_directory
+            )
+
+            self.add_to_timeline(
+                results,
+                start_time=video_segment['start_time'],
+                end_time=video_segment['end_time'],
+                capture_times=(video_segment['timestamps'], video_segment['samples_per_timestamp']),
+                content_length=len(video_segment['frames'])
+            )
+            self.video_segment_index += 1
+
     def get_local_paths(self, dir, audio_detection=True, video_detection=True, time_indexed_files=True):
         sort_by_index = lambda path: int(path.split('/')[-1].split('_')[0][3:])
         audio_filenames, video_filenames = [], []
@@ -147,22 +399,38 @@ class StutterDetection():
             if time_indexed_files: audio_filenames = list(sorted(audio_filenames, key=sort_by_index))
 
         if video_detection:
+            # Indexed (.mjpeg) segments are listed as soon as they are created and read while still being written
             if os.path.basename(os.path.normpath(dir)) == "video":
-                video_dir = os.path.join(dir, "*.mp4")
+                video_dir = dir
             else:
-                video_dir = os.path.join(dir, "video/*.mp4")
+                video_dir = os.path.join(dir, "video/")
 
-            video_filenames = glob.glob(video_dir)
+            video_filenames = glob.glob(os.path.join(video_dir, "*.mp4")) + glob.glob(os.path.join(video_dir, "*.mjpeg"))
 
             if len(video_filenames) == 0:
-                video_dir = os.path.join(dir, "*.mp4")
-                video_filenames = glob.glob(video_dir)
+                video_filenames = glob.glob(os.path.join(dir, "*.mp4")) + glob.glob(os.path.join(dir, "*.mjpeg"))
 
             if time_indexed_files: video_filenames = list(sorted(video_filenames, key=sort_by_index))
 
         return audio_filenames, video_filenames
 
+    @staticmethod
+    def audio_samples(audio_content):
+        # (channels, samples) array of audio content that may be a memory-mapped WavReader or a ContainerReader
+        return audio_content.samples if isinstance(audio_content, (WavReader, ContainerReader)) else audio_content
+
     def get_local_audio(self, filename):
+        # Audio of combined mp4 segments is demuxed (and decoded to float32) without extracting a WAV file first
+        if filename.endswith(".mp4"):
+            return self.get_local_container(filename, video=False)[0]
+
+        # Long recordings are memory-mapped (as (channels, samples)) for detection a chunk at a time
+        if self.audio_chunk_s is not None:
+            audio_source = WavReader(filename, chunk_s=self.audio_chunk_s)
+            if len(audio_source) > self.audio_chunk_s * audio_source.sample_rate:
+                return audio_source
+            audio_source.close()
+
         # Retrieve and decode wav file from local storage
         samplerate, audio_asset = wavfile.read(filename)
 
@@ -174,7 +442,101 @@ class StutterDetection():
 
         return audio_asset
 
-    def get_local_video(self, filename):
+    def get_local_container(self, filename, epochs=1, audio=True, video=True):
+        # Decode the audio and (sampled) video of a combined mp4 in one pass over the container. Returns the audio
+        # content (a ContainerReader to analyse a chunk at a time if longer than `audio_chunk_s`) and the video's
+        # frames and sampling, as `get_sampled_local_video` does.
+        container = ContainerReader(filename) if self.audio_chunk_s is None else ContainerReader(filename, chunk_s=self.audio_chunk_s)
+        frame_transform = lambda frame: self.resize_frame(frame, self.decode_size)
+
+        # Audio longer than `audio_chunk_s` (by the header) is left undecoded, for `chunks` to decode a chunk at a time
+        chunked = audio and self.audio_chunk_s is not None and len(container) > self.audio_chunk_s * container.sample_rate
+        decode_audio = audio and not chunked
+
+        try:
+            if not video:
+                if decode_audio: container.decode(video=False)
+                frames, sampling = None, None
+            elif not self.sampled_decode or container.frame_count == 0:
+                frames, _ = container.decode(audio=decode_audio, frame_transform=frame_transform)
+                sampling = {}
+            else:
+                frame_count = container.frame_count
+                frame_indices = [self.video_detector.sample_frame_indices(frame_count) for _ in range(epochs)]
+                frames, decoded_indices = container.decode(audio=decode_audio, frame_indices=np.unique(np.concatenate(frame_indices)), frame_transform=frame_transform)
+                sampling = {
+                    "frame_indices": frame_indices,
+                    "decoded_indices": decoded_indices,
+                    "frame_count": frame_count
+                }
+        finally:
+            container.close()
+
+        audio_content = None
+        if audio:
+            audio_content = container if chunked else container.samples
+
+        return audio_content, (frames, sampling)
+
+    def get_sampled_local_video(self, filename, epochs=1):
+        # Decode only the frames sampled by the video detector for each inference epoch. Returns the frames along
+        # with the keyword arguments `video_detection` needs to map the sampled indices onto them.
+        if not self.sampled_decode:
+            return self.get_local_video(filename, decode_size=self.decode_size), {}
+
+        frame_count = self.get_video_frame_count(filename)
+        if frame_count == 0:
+            return self.get_local_video(filename, decode_size=self.decode_size), {}
+
+        frame_indices = [self.video_detector.sample_frame_indices(frame_count) for _ in range(epochs)]
+        video_asset, decoded_indices = self.get_local_video(filename, np.concatenate(frame_indices), self.decode_size)
+
+        return video_asset, {
+            "frame_indices": frame_indices,
+            "decoded_indices": decoded_indices,
+            "frame_count": frame_count
+        }
+
+    def get_video_frame_count(self, filename):
+        # Frame count from the container (or index) without decoding, 0 if unknown. Indexed segments still being
+        # written give the frame count they are expected to reach, so frames can be sampled before they exist.
+        if filename.endswith(".mjpeg"):
+            video_source = IndexedSegmentReader(filename)
+            frame_count = video_source.expected_frames if video_source.expected_frames is not None else video_source.wait()
+            video_source.close()
+
+            return frame_count
+
+        video_source = cv2.VideoCapture(filename)
+        frame_count = max(int(video_source.get(cv2.CAP_PROP_FRAME_COUNT)), 0)
+        video_source.release()
+
+        return frame_count
+
+    @staticmethod
+    def resize_frame(frame, decode_size=None):
+        # Shrink so the shortest side is `decode_size` pixels (frames already smaller are left as they are)
+        height, width = frame.shape[:2]
+        if decode_size is None or min(height, width) <= decode_size:
+            return frame
+
+        scale = decode_size / min(height, width)
+        return cv2.resize(frame, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+
+    def get_local_video(self, filename, frame_indices=None, decode_size=None):
+        # With `frame_indices`, only those frames are decoded (into one preallocated array) and the indices actually
+        # decoded are returned alongside, as a container may hold fewer frames than its header reports
+        if frame_indices is not None:
+            return self.get_local_video_frames(filename, np.unique(frame_indices), decode_size)
+
+        # Indexed segments are decoded frame by frame as they are written (waiting for the segment to complete)
+        if filename.endswith(".mjpeg"):
+            video_source = IndexedSegmentReader(filename)
+            frame_buffer = [self.resize_frame(frame, decode_size) for _, frame in video_source.frames(follow=True)]
+            video_source.close()
+
+            return np.stack(frame_buffer, axis=0)  # dimensions (T, H, W, C)
+
         # Retrieve and decode mp4 file from local storage
         video_source = cv2.VideoCapture(filename)
         frame_buffer = []
@@ -184,16 +546,139 @@ class StutterDetection():
             # Read video frame-by-frame from the opencv capture object; img is (H, W, C)
             success, frame = video_source.read()
             if success:
-                frame_buffer.append(frame)
+                frame_buffer.append(self.resize_frame(frame, decode_size))
 
         video_asset = np.stack(frame_buffer, axis=0)  # dimensions (T, H, W, C)
 
         return video_asset
 
-    def audio_detection(self, audio_content, time_indexed_audio=False, detect_gaps=True, detect_discontinuities=True, detect_clicks=False, plot=False, audio_fname='', start_time=0, end_time=0, output_dir='./'):
-        time_indexed_audio = time_indexed_audio and start_time != 0 and end_time != 0
+    def get_local_video_frames(self, filename, frame_indices, decode_size=None):
+        # Decode the sorted `frame_indices` only: indexed segments seek straight to each frame (waiting for it to be
+        # written if the segment is still being captured), mp4 frames in between are grabbed (demuxed without being
+        # converted) and skipped
+        video_asset = None
+        decoded = 0
+
+        if filename.endswith(".mjpeg"):
+            video_source = IndexedSegmentReader(filename)
+            read_frame = lambda index: video_source.frame(index) if video_source.wait(index + 1) > index else None
+        else:
+            video_source = cv2.VideoCapture(filename)
+            position = 0
+
+            def read_frame(index):
+                nonlocal position
+                while position < index and video_source.grab():
+                    position += 1
+                if position < index:
+                    return None
+
+                success, frame = video_source.read()
+                position += 1
+                return frame if success else None
+
+        for index in frame_indices:
+            frame = read_frame(index)
+            if frame is None:
+                break
+
+            frame = self.resize_frame(frame, decode_size)
+            if video_asset is None:
+                video_asset = np.empty((len(frame_indices), *frame.shape), dtype=frame.dtype)  # dimensions (T, H, W, C)
+
+            video_asset[decoded] = frame
+            decoded += 1
+
+        if filename.endswith(".mjpeg"):
+            video_source.close()
+        else:
+            video_source.release()
+
+        if decoded == 0:
+            raise ValueError(f"No frames could be decoded from {filename}")
+
+        return video_asset[:decoded], np.asarray(frame_indices[:decoded])
+
+    def get_capture_times(self, filename):
+        # Monotonic capture times of each frame/audio chunk, if the capture module wrote a timestamps sidecar
+        sidecar_path = f"{os.path.splitext(filename)[0]}.timestamps.npz"
+        if not os.path.isfile(sidecar_path):
+            return None
+
+        sidecar = np.load(sidecar_path)
+        return sidecar['capture_ns'], int(sidecar['samples_per_timestamp'])
+
+    def get_capture_drops(self, filename):
+        # Capture times of frames/audio chunks dropped by the capture queues (not by the device under test)
+        sidecar_path = f"{os.path.splitext(filename)[0]}.timestamps.npz"
+        if not os.path.isfile(sidecar_path):
+            return None
+
+        sidecar = np.load(sidecar_path)
+        return sidecar['dropped_ns'] if 'dropped_ns' in sidecar.files else None
+
+    @staticmethod
+    def capture_time_offsets(capture_times, content_length, length):
+        # Seconds since segment start at `length` evenly spaced positions over content of `content_length` samples/frames
+        return StutterDetection.capture_offsets_at(capture_times, np.linspace(0, content_length - 1, length))
+
+    @staticmethod
+    def capture_offsets_at(capture_times, positions):
+        # Seconds since segment start at sample/frame `positions` of the content
+        capture_ns, samples_per_timestamp = capture_times
+        capture_ns = np.asarray(capture_ns, dtype=np.int64)
+        chunk_positions = np.arange(len(capture_ns)) * samples_per_timestamp
+
+        # Extend by one step so positions within the final chunk are interpolated rather than clamped
+        if len(capture_ns) > 1:
+            chunk_positions = np.append(chunk_positions, chunk_positions[-1] + samples_per_timestamp)
+            capture_ns = np.append(capture_ns, capture_ns[-1] + (capture_ns[-1] - capture_ns[0]) // (len(capture_ns) - 1))
+
+        return np.interp(positions, chunk_positions, capture_ns - capture_ns[0]) / 1e9
+
+    def report_capture_drops(self, capture_drops, capture_times=None, start_time=0):
+        # Drops made by the capture pipeline explain gaps in the segment that are not stutter in the device output
+        if capture_drops is None or len(capture_drops) == 0:
+            return []
+
+        if capture_times is not None and start_time != 0:
+            drop_offsets = (np.asarray(capture_drops, dtype=np.int64) - capture_times[0][0]) / 1e9
+            drop_times = [t.strftime('%H:%M:%S.%f') for t in self.offset_times(start_time, drop_offsets)]
+        else:
+            drop_times = list(capture_drops)
+
+        print(f"     * Capture-side drops (not device stutter): {len(capture_drops)} at {drop_times}")
+        return drop_times
+
+    @staticmethod
+    def offset_times(startpoint, time_offsets):
+        # Datetimes at offsets (seconds) from the segment start time
+        start = np.datetime64(startpoint, 'us')
+        return (start + np.round(time_offsets * 1e6).astype('timedelta64[us]')).astype(object)
+
+    def run_audio_detector(self, audio_content, start_time=0, detect_gaps=True, detect_discontinuities=True, detect_clicks=False, capture_times=None):
+        # Raw detections only (no reporting), so it can run on a worker thread
+        if self.audio_stream:
+            return self.audio_detector.process_stream(
+                self.audio_samples(audio_content),
+                start_time=start_time,
+                capture_times=capture_times,
+                gap_detection=detect_gaps,
+                discontinuity_detection=detect_discontinuities,
+                click_detection=detect_clicks
+            )
 
-        audio_results = self.audio_detector.process(
+        if isinstance(audio_content, (WavReader, ContainerReader)):
+            return self.audio_detector.process_chunks(
+                audio_content.chunks(),
+                start_time=start_time,
+                gap_detection=detect_gaps,
+                discontinuity_detection=detect_discontinuities,
+                click_detection=detect_clicks,
+                peak=audio_content.peak()
+            )
+
+        return self.audio_detector.process(
             audio_content,
             start_time=start_time,
             gap_detection=detect_gaps,
@@ -201,6 +686,13 @@ class StutterDetection():
             click_detection=detect_clicks
         )
 
+    def audio_detection(self, audio_content, time_indexed_audio=False, detect_gaps=True, detect_discontinuities=True, detect_clicks=False, plot=False, audio_fname='', start_time=0, end_time=0, capture_times=None, capture_drops=None, output_dir='./', audio_results=None):
+        # `audio_results` are detections already made by `run_audio_detector` (e.g. by a pipelined worker)
+        time_indexed_audio = time_indexed_audio and start_time != 0 and end_time != 0
+
+        if audio_results is None:
+            audio_results = self.run_audio_detector(audio_content, start_time, detect_gaps, detect_discontinuities, detect_clicks, capture_times)
+
         detected_audio_gaps = audio_results['gaps']
         detected_audio_discontinuities = audio_results['discontinuities']
         detected_audio_clicks = audio_results['clicks']
@@ -215,43 +707,41 @@ class StutterDetection():
 
         if detect_clicks: print(f"     * Detected click times: {detected_audio_clicks}")
         if detect_discontinuities: print(f"     * Detected discontinuity times: {detected_audio_discontinuities}")
+        capture_drop_times = self.report_capture_drops(capture_drops, capture_times, start_time if time_indexed_audio else 0)
 
         # Plot audio signal and any detections
         if plot:
-            self.plot_audio(audio_content, detected_audio_gaps, detected_audio_clicks, start_time, end_time, time_indexed_audio, output_dir, audio_fname)
+            self.plot_audio(self.audio_samples(audio_content), detected_audio_gaps, detected_audio_clicks, start_time, end_time, time_indexed_audio, output_dir, audio_fname, capture_times)
 
         print()
         return {
             "gaps": detected_audio_gaps,
             "discontinuities": detected_audio_discontinuities,
-            "clicks": detected_audio_clicks
+            "clicks": detected_audio_clicks,
+            "capture_drops": capture_drop_times
         }
 
-    def plot_audio(self, audio_content, gap_times, click_times, startpoint, endpoint, time_indexed_files, output_path, audio_name):
+    def plot_audio(self, audio_content, gap_times, click_times, startpoint, endpoint, time_indexed_files, output_path, audio_name, capture_times=None):
         # Setup
-        plt.rcParams['agg.path.chunksize'] = 1000
         fig, axs = plt.subplots(1, figsize=(20, 10), tight_layout=True)
 
-        # Form timeline over clip
-        time_index = np.linspace(0, len(audio_content[0]), len(audio_content[0]))
-
-        if time_indexed_files and startpoint != 0 and endpoint != 0:
-            time_x = np.linspace(0, 1, len(audio_content[0])) * (endpoint - startpoint) + startpoint
-        else:
-            n_secs = len(audio_content[0]) / self.audio_fps
-            time_x = np.linspace(0, n_secs, len(audio_content[0]))
+        # The signal is drawn as a min/max envelope of buckets of samples, so times are only formed per bucket (and
+        # per tick) and a memory-mapped recording is read through once rather than expanded per sample
+        length = len(audio_content[0])
+        bucket = max(1, math.ceil(length / AUDIO_PLOT_BUCKETS))
+        time_index = np.arange(0, length, bucket)
+        time_x = self.audio_sample_times(time_index, length, startpoint, endpoint, time_indexed_files, capture_times)
 
         # Plot L/R/Mono channels
         for idx, audio_channel in enumerate(audio_content):
-            axs.plot(time_index, audio_channel, color='k', alpha=0.5, linewidth=0.5, label=f"Channel {idx}")
+            lows, highs = self.sample_envelope(audio_channel, bucket)
+            axs.fill_between(time_index, lows, highs, color='k', alpha=0.5, linewidth=0.5, label=f"Channel {idx}")
 
         # Plot time range of any audio gaps
         if len(gap_times) > 0:
             for start, end in gap_times:
-                approx_gap_start = min(time_x, key=lambda dt: abs(dt - start))
-                approx_gap_start_idx = np.where(time_x == approx_gap_start)[0][0]
-                approx_gap_end = min(time_x, key=lambda dt: abs(dt - end))
-                approx_gap_end_idx = np.where(time_x == approx_gap_end)[0][0]
+                approx_gap_start_idx = time_index[np.argmin(np.abs(time_x - start))]
+                approx_gap_end_idx = time_index[np.argmin(np.abs(time_x - end))]
 
                 line = axs.axvspan(approx_gap_start_idx, approx_gap_end_idx, color='b', alpha=0.3)
 
@@ -260,18 +750,19 @@ class StutterDetection():
         # Plot time range of any click artefacts
         if len(click_times) > 0:
             for time in click_times:
-                approx_click_time = min(time_x, key=lambda dt: abs(dt - time))
-                approx_click_idx = np.where(time_x == approx_click_time)[0][0]
+                approx_click_idx = time_index[np.argmin(np.abs(time_x - time))]
                 line = axs.axvline(approx_click_idx, color='r', linewidth=1)
 
             line.set_label('Detected click')
 
-        axs.set_xticks(time_index[::self.audio_fps])
+        tick_index = np.arange(0, length, self.audio_fps)
+        tick_x = self.audio_sample_times(tick_index, length, startpoint, endpoint, time_indexed_files, capture_times)
+        axs.set_xticks(tick_index)
         if time_indexed_files:
-            times = [t.strftime('%H:%M:%S') for t in time_x[::self.audio_fps]]
+            times = [t.strftime('%H:%M:%S') for t in tick_x]
             axs.set_xticklabels(times, fontsize=12, rotation=90)
         else:
-            axs.set_xticklabels([round(t) for t in time_x[::self.audio_fps]], fontsize=12, rotation=90)
+            axs.set_xticklabels([round(t) for t in tick_x], fontsize=12, rotation=90)
 
         plt.yticks(fontsize=12)
 
@@ -279,8 +770,9 @@ class StutterDetection():
         plt.legend(loc=1, fontsize=14)
 
         if time_indexed_files:
+            segment_start, segment_end = self.audio_sample_times(np.array([0, length - 1]), length, startpoint, endpoint, time_indexed_files, capture_times)
             plt.xlabel("\nCapture Time (H:M:S)", fontsize=14)
-            plt.title(f"Audio Defect Detection: Segment {self.audio_segment_index} ({time_x[0].strftime('%H:%M:%S')} => {time_x[-1].strftime('%H:%M:%S')})) \n", fontsize=18)
+            plt.title(f"Audio Defect Detection: Segment {self.audio_segment_index} ({segment_start.strftime('%H:%M:%S')} => {segment_end.strftime('%H:%M:%S')})) \n", fontsize=18)
         else:
             plt.xlabel("\nCapture Time (s)", fontsize=14)
 
@@ -296,7 +788,115 @@ class StutterDetection():
         fig.savefig(output_path)
         plt.close(fig)
 
-    def video_detection(self, video_content, time_indexed_video=False, plot=False, start_time=0, end_time=0, epochs=1, output_dir='./'):
+    def audio_sample_times(self, positions, length, startpoint, endpoint, time_indexed_files, capture_times=None):
+        # Capture times (or seconds, without time indexed files) of sample `positions` in audio of `length` samples
+        if time_indexed_files and startpoint != 0 and capture_times is not None:
+            return self.offset_times(startpoint, self.capture_offsets_at(capture_times, positions))
+        elif time_indexed_files and startpoint != 0 and endpoint != 0:
+            return positions / max(length - 1, 1) * (endpoint - startpoint) + startpoint
+
+        return positions / self.audio_fps
+
+    @staticmethod
+    def sample_envelope(samples, bucket):
+        # Minimum and maximum of each run of `bucket` samples (the last run may be shorter)
+        whole = len(samples) // bucket * bucket
+        buckets = samples[:whole].reshape(-1, bucket)
+        lows, highs = buckets.min(axis=1), buckets.max(axis=1)
+
+        if whole < len(samples):
+            lows = np.append(lows, samples[whole:].min())
+            highs = np.append(highs, samples[whole:].max())
+
+        return lows, highs
+
+    def infer_video(self, video_content, epochs=1, frame_indices=None, decoded_indices=None, frame_count=None):
+        # MaxVQA scores of every inference epoch and the time they took (no reporting). With `batched_epochs`, the
+        # epochs' sampled views go through the encoder as one batch.
+        if epochs > 1 and self.use_batched_epochs(video_content, frame_indices, decoded_indices):
+            return self.infer_video_batch([{
+                'frames': video_content,
+                'sampling': {'frame_indices': frame_indices, 'decoded_indices': decoded_indices} if frame_indices is not None else {}
+            }], epochs)[0]
+
+        processing_time_start = timer()
+        scores = np.zeros(shape=(epochs,), dtype=object)
+        for i in range(epochs):
+            score_per_patch = self.video_detector.process(
+                video_content,
+                frame_indices=frame_indices[i] if frame_indices is not None else None,
+                decoded_indices=decoded_indices
+            )
+            scores[i] = np.array(score_per_patch)
+
+        return scores, timer() - processing_time_start
+
+    def use_batched_epochs(self, video_content, frame_indices=None, decoded_indices=None):
+        # Batched epochs are checked once, on the first segment with sampled indices, against a pass per epoch
+        if not self.batched_epochs or frame_indices is None:
+            return False
+
+        if self.batched_epochs_match is None:
+            self.batched_epochs_match = self.video_detector.batched_epochs_match(video_content, frame_indices, decoded_indices)
+            if not self.batched_epochs_match:
+                warnings.warn("Batched inference epochs do not match a pass per epoch, running epochs separately")
+
+        return self.batched_epochs_match
+
+    def use_batched_segments(self, video_segments, epochs=1):
+        # Batched segments are checked once, on the first two segments of the first batch, against a pass per segment
+        if self.batched_segments_match is None:
+            checked = video_segments[:2]
+            self.batched_segments_match = self.video_detector.batch_matches(
+                [segment['frames'] for segment in checked],
+                frame_indices=[segment['sampling'].get('frame_indices') for segment in checked],
+                decoded_indices=[segment['sampling'].get('decoded_indices') for segment in checked],
+                epochs=epochs
+            )
+            if not self.batched_segments_match:
+                warnings.warn("Batched video segments do not match a pass per segment, running segments separately")
+
+        return self.batched_segments_match
+
+    def infer_video_batch(self, video_segments, epochs=1):
+        # `infer_video` over several loaded video segments at once, every epoch of every segment in one forward pass.
+        # The processing time reported for each segment is its share of the batch.
+        if len(video_segments) == 0:
+            return []
+        if len(video_segments) == 1 and epochs == 1:
+            return [self.infer_video(video_segments[0]['frames'], epochs, **video_segments[0]['sampling'])]
+
+        # Epochs are only batched once checked (on the first segment) to match a pass per epoch
+        first_segment = video_segments[0]
+        if epochs > 1 and not self.use_batched_epochs(first_segment['frames'], first_segment['sampling'].get('frame_indices'), first_segment['sampling'].get('decoded_indices')):
+            return [self.infer_video(segment['frames'], epochs, **segment['sampling']) for segment in video_segments]
+
+        # Likewise segments are only batched together once checked (on the first batch) to match a pass per segment
+        if len(video_segments) > 1 and not self.use_batched_segments(video_segments, epochs):
+            return [self.infer_video(segment['frames'], epochs, **segment['sampling']) for segment in video_segments]
+
+        processing_time_start = timer()
+        outputs = self.video_detector.process_batch(
+            [segment['frames'] for segment in video_segments],
+            frame_indices=[segment['sampling'].get('frame_indices') for segment in video_segments],
+            decoded_indices=[segment['sampling'].get('decoded_indices') for segment in video_segments],
+            epochs=epochs
+        )
+
+        scores = []
+        for segment_outputs in outputs:
+            segment_scores = np.zeros(shape=(epochs,), dtype=object)
+            for i, score_per_patch in enumerate(segment_outputs):
+                segment_scores[i] = np.array(score_per_patch)
+            scores.append(segment_scores)
+
+        processing_time = (timer() - processing_time_start) / len(video_segments)
+        return [(segment_scores, processing_time) for segment_scores in scores]
+
+    def video_detection(self, video_content, time_indexed_video=False, plot=False, start_time=0, end_time=0, epochs=1, capture_times=None, capture_drops=None, output_dir='./', frame_indices=None, decoded_indices=None, frame_count=None, video_inference=None):
+        # With sampled decode, `video_content` only holds the frames at `decoded_indices` of a `frame_count` frame
+        # segment, and `frame_indices` holds the detector's sampled indices for each epoch. `video_inference` is the
+        # output of `infer_video` if inference has already been run.
         time_indexed_video = time_indexed_video and start_time != 0 and end_time != 0
         if time_indexed_video:
             video = []
@@ -311,13 +911,10 @@ class StutterDetection():
         # MaxVQA AI detection process
         print(f"\n * Video detection (segment {self.video_segment_index}):")
 
-        processing_time_start = timer()
-        scores = np.zeros(shape=(epochs,), dtype=object)
-        for i in range(epochs):
-            score_per_patch = self.video_detector.process(video_content)
-            scores[i] = np.array(score_per_patch)
+        if video_inference is None:
+            video_inference = self.infer_video(video_content, epochs, frame_indices, decoded_indices)
 
-        processing_time_end = timer() - processing_time_start
+        scores, processing_time_end = video_inference
         score_per_patch = np.mean(scores, axis=0)
         local_scores = np.mean(score_per_patch, axis=0)
         global_scores = np.mean(local_scores, axis=1)
@@ -325,14 +922,26 @@ class StutterDetection():
 
         print(f"     * Global VQA scores  : {np.array([f'{i}: {s:.2f}' for i, s in enumerate(global_scores)], dtype=str)}")
         print(f"     * Processing time    : {processing_time_end:.2f}s")
+        self.report_capture_drops(capture_drops, capture_times, start_time)
 
         if plot:
-            self.plot_local_vqa(local_scores, startpoint=start_time, endpoint=end_time, output_path=output_dir)
+            time_offsets = None
+            if capture_times is not None:
+                content_length = frame_count if frame_count is not None else len(video_content)
+                time_offsets = self.capture_time_offsets(capture_times, content_length, local_scores.shape[1])
+
+            self.plot_local_vqa(local_scores, startpoint=start_time, endpoint=end_time, time_offsets=time_offsets, output_path=output_dir)
 
         print()
         return output
 
-    def plot_local_vqa(self, vqa_values, true_time_labels=None, startpoint=0, endpoint=0, plot_motion_only=True, output_path='./', output_file=''):
+    def plot_local_vqa(self, vqa_values, true_time_labels=None, startpoint=0, endpoint=0, time_offsets=None, plot_motion_only=True, output_path='./', output_file=''):
+        # `vqa_values` is either one segment's local scores or a TimelineStore of them (timed from its column times)
+        if isinstance(vqa_values, TimelineStore):
+            if time_offsets is None and startpoint != 0 and endpoint != 0 and len(vqa_values) > 0:
+                time_offsets = (vqa_values.times() - np.datetime64(startpoint, 'ns').astype(np.int64)) / 1e9
+            vqa_values = vqa_values.values()
+
         # Metrics & figure setup
         if plot_motion_only:
             priority_metrics = [14]
@@ -357,7 +966,10 @@ class StutterDetection():
         # Timestamps
         time_indexed_files = startpoint != 0 and endpoint != 0
         if time_indexed_files:
-            time_x = np.linspace(0, 1, len(plot_values[0])) * (endpoint - startpoint) + startpoint
+            if time_offsets is not None:
+                time_x = self.offset_times(startpoint, time_offsets)
+            else:
+                time_x = np.linspace(0, 1, len(plot_values[0])) * (endpoint - startpoint) + startpoint
             time_index = np.linspace(0, len(plot_values[0]), len(plot_values[0]))
 
         for value_id, (ax_id, title) in enumerate(titles.items()):
@@ -446,6 +1058,16 @@ if __name__ == '__main__':
     parser.add_argument('-f', '--frames', type=int, default=256, help="Number of frames to downsample video to")
     parser.add_argument('-e', '--epochs', type=int, default=1, help="Number of times to repeat inference per video")
     parser.add_argument('-d', '--device', type=str, default='cpu', help="Specify processing hardware")
+    parser.add_argument('-fd', '--full-decode', action='store_true', default=False, help="Decode every frame of each video segment rather than only the frames sampled for inference")
+    parser.add_argument('-p', '--pipelined', action='store_true', default=False, help="Decode the next segment and run audio detection in the background while video inference runs")
+    parser.add_argument('-b', '--batch-size', type=int, default=1, help="Number of video segments to run through MaxVQA in each forward pass")
+    parser.add_argument('-tl', '--timeline-path', type=str, default=None, help="Directory to spill the motion timeline to as memory-mapped files, rather than holding it in RAM")
+    parser.add_argument('-aw', '--audio-workers', type=int, default=0, help="Spread audio detection over this many processes, by segment, channel and detector")
+    parser.add_argument('-awn', '--audio-window', type=int, default=None, help="Number of segments ahead whose audio is submitted to the audio workers (default: twice the workers)")
+    parser.add_argument('-ac', '--audio-chunk', type=float, default=None, help="Memory-map WAV files longer than this (s) and run audio detection over them in chunks of this length")
+    parser.add_argument('-be', '--batched-epochs', action='store_true', default=False, help="Run each segment's inference epochs through MaxVQA as one batch (checked on the first segment against a pass per epoch)")
+    parser.add_argument('-as', '--audio-stream', action='store_true', default=False, help="Carry audio detector state across consecutive segments, skipping the overlap between them")
+    parser.add_argument('-ds', '--decode-size', type=int, default=None, help="Shrink decoded frames to this shortest side (px), trading fragment detail for decode time and memory")
 
     # Decode input parameters to toggle between cameras, microphones, and setup mode.
     warnings.filterwarnings("ignore")
@@ -463,7 +1085,7 @@ if __name__ == '__main__':
     index_by_file_timestamp = args.time_indexed_files
 
     # Initialise and run Stutter Detection module
-    detector = StutterDetection(video_downsample_frames=frames, device=device)
+    detector = StutterDetection(video_downsample_frames=frames, device=device, sampled_decode=not args.full_decode, decode_size=args.decode_size, timeline_path=args.timeline_path, audio_workers=args.audio_workers, audio_window=args.audio_window, audio_chunk_s=args.audio_chunk, audio_stream=args.audio_stream, batched_epochs=args.batched_epochs)
 
     if path.endswith(".mp4") or path.endswith(".wav"):
         detector.process(
@@ -472,7 +1094,9 @@ if __name__ == '__main__':
             inference_epochs=epochs,
             audio_detection=audio_on,
             video_detection=video_on,
-            output_directory=out_path
+            output_directory=out_path,
+            pipelined=args.pipelined,
+            batch_size=args.batch_size
         )
     else:
         if plot_true_timestamps:
@@ -492,7 +1116,9 @@ if __name__ == '__main__':
                 inference_epochs=epochs,
                 audio_detection=audio_on,
                 video_detection=video_on,
-                output_directory=out_path
+                output_directory=out_path,
+                pipelined=args.pipelined,
+                batch_size=args.batch_size
             )
         else:
             detector.process(
@@ -501,5 +1127,7 @@ if __name__ == '__main__':
                 inference_epochs=epochs,
                 audio_detection=audio_on,
                 video_detection=video_on,
-                output_directory=out_path
+                output_directory=out_path,
+                pipelined=args.pipelined,
+                batch_size=args.batch_size
             )
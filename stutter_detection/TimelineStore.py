@@ -0,0 +1,112 @@
+import os
+import bisect
+import numpy as np
+
+
+class TimelineStore():
+    def __init__(self, rows=16, chunk_length=4096, spill_path=None, dtype=np.float64):
+        # Detection scores over time as (rows, columns), appended in fixed-size preallocated chunks so adding a
+        # segment never copies the history. With `spill_path`, chunks are memory-mapped files in that directory
+        # so long runs are not held in RAM.
+        self.rows = rows
+        self.chunk_length = chunk_length
+        self.spill_path = spill_path
+        self.dtype = dtype
+
+        # Each column has an int64 time (ns since the epoch for time-indexed segments, else its column position)
+        self.value_chunks = []
+        self.time_chunks = []
+        self.chunk_start_times = []
+        self.length = 0
+
+        if spill_path is not None:
+            os.makedirs(spill_path, exist_ok=True)
+
+    def __len__(self):
+        return self.length
+
+    @property
+    def shape(self):
+        return self.rows, self.length
+
+    def add_chunk(self):
+        chunk_index = len(self.value_chunks)
+        if self.spill_path is not None:
+            values = np.lib.format.open_memmap(
+                os.path.join(self.spill_path, f"values{chunk_index}.npy"), mode='w+', dtype=self.dtype, shape=(self.rows, self.chunk_length)
+            )
+            times = np.lib.format.open_memmap(
+                os.path.join(self.spill_path, f"times{chunk_index}.npy"), mode='w+', dtype=np.int64, shape=(self.chunk_length,)
+            )
+        else:
+            values = np.empty((self.rows, self.chunk_length), dtype=self.dtype)
+            times = np.empty(self.chunk_length, dtype=np.int64)
+
+        self.value_chunks.append(values)
+        self.time_chunks.append(times)
+
+    def append(self, values, times=None):
+        # Append (rows, n) values. Times must not decrease along the timeline; without them, columns are timed
+        # by position.
+        values = np.asarray(values)
+        columns = values.shape[1]
+        times = np.arange(self.length, self.length + columns) if times is None else np.asarray(times, dtype=np.int64)
+
+        written = 0
+        while written < columns:
+            offset = self.length % self.chunk_length
+            if offset == 0:
+                self.add_chunk()
+                self.chunk_start_times.append(int(times[written]))
+
+            count = min(self.chunk_length - offset, columns - written)
+            self.value_chunks[-1][:, offset:offset + count] = values[:, written:written + count]
+            self.time_chunks[-1][offset:offset + count] = times[written:written + count]
+
+            written += count
+            self.length += count
+
+    def column_range(self, start_time=None, end_time=None):
+        # Column positions [start, end) of the values timed within [start_time, end_time]
+        start = 0 if start_time is None else self.search(start_time, 'left')
+        end = self.length if end_time is None else self.search(end_time, 'right')
+        return start, max(start, end)
+
+    def search(self, time, side):
+        # Binary search over chunk start times for the chunk that must hold the boundary, then within that chunk
+        # (a boundary past its last column is the start of the next chunk)
+        find_chunk = bisect.bisect_left if side == 'left' else bisect.bisect_right
+        chunk_index = max(find_chunk(self.chunk_start_times, time) - 1, 0)
+        chunk_columns = min(self.chunk_length, self.length - chunk_index * self.chunk_length)
+
+        return chunk_index * self.chunk_length + int(np.searchsorted(self.time_chunks[chunk_index][:chunk_columns], time, side))
+
+    def gather(self, chunks, start, end):
+        # Copy columns [start, end) out of the chunks into one contiguous array
+        if end <= start:
+            return chunks[0][..., :0].copy()
+
+        parts = []
+        for chunk_index in range(start // self.chunk_length, (end - 1) // self.chunk_length + 1):
+            chunk_start = chunk_index * self.chunk_length
+            parts.append(chunks[chunk_index][..., max(start - chunk_start, 0):min(end - chunk_start, self.chunk_length)])
+
+        return np.concatenate(parts, axis=-1)
+
+    def values(self, start_time=None, end_time=None):
+        # (rows, n) values timed within [start_time, end_time] (the whole timeline by default)
+        if self.length == 0:
+            return np.empty((self.rows, 0), dtype=self.dtype)
+
+        return self.gather(self.value_chunks, *self.column_range(start_time, end_time))
+
+    def times(self, start_time=None, end_time=None):
+        if self.length == 0:
+            return np.empty(0, dtype=np.int64)
+
+        return self.gather(self.time_chunks, *self.column_range(start_time, end_time))
+
+    def flush(self):
+        for chunk in self.value_chunks + self.time_chunks:
+            if isinstance(chunk, np.memmap):
+                chunk.flush()
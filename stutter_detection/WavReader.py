@@ -0,0 +1,43 @@
+import numpy as np
+from scipy.io import wavfile
+
+
+class WavReader():
+    def __init__(self, path, chunk_s=30):
+        # Memory-mapped WAV read in chunks, so memory use does not grow with the recording's length
+        self.path = path
+        self.sample_rate, samples = wavfile.read(path, mmap=True)
+        self.chunk_s = chunk_s
+
+        # (channels, samples) view of the mapped file (nothing is read until sliced)
+        self.samples = samples.reshape(len(samples), -1).T
+        self.peak_value = None
+
+    @property
+    def shape(self):
+        return self.samples.shape
+
+    def __len__(self):
+        return self.samples.shape[1]
+
+    def peak(self):
+        # Absolute peak over every channel, found a chunk at a time (abs taken in a wider type so -32768 is kept)
+        if self.peak_value is None:
+            chunk_length = int(self.chunk_s * self.sample_rate)
+            self.peak_value = 0
+            for start in range(0, len(self), chunk_length):
+                chunk = self.samples[:, start:start + chunk_length]
+                self.peak_value = max(self.peak_value, np.max(np.abs(chunk.astype(np.float64))))
+
+        return self.peak_value
+
+    def chunks(self):
+        # Yields consecutive (channels, samples) chunks of `chunk_s`, for detectors that carry their state over from
+        # one chunk to the next
+        chunk_length = max(int(self.chunk_s * self.sample_rate), 1)
+        for start in range(0, len(self), chunk_length):
+            yield self.samples[:, start:start + chunk_length]
+
+    def close(self):
+        # Drop the mapped samples (the file is unmapped once no views taken from them remain)
+        self.samples = None
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The capture and detection scripts import their modules by name, as when run from their own directories
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for directory in ('capture', 'stutter_detection'):
+    sys.path.insert(0, os.path.join(REPOSITORY, directory))
@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+from scipy.io import wavfile
+
+pytest.importorskip('essentia')
+
+from WavReader import WavReader
+from EssentiaAudioDetector import AudioDetector, SAMPLE_RATE
+
+
+def write_tone(path, length_s, gap_s):
+    # Stereo 440 Hz tone (int16) that is silent between the (start, end) seconds of `gap_s`
+    t = np.arange(int(length_s * SAMPLE_RATE)) / SAMPLE_RATE
+    tone = (0.5 * np.sin(2 * np.pi * 440 * t) * 32767).astype(np.int16)
+    tone[int(gap_s[0] * SAMPLE_RATE):int(gap_s[1] * SAMPLE_RATE)] = 0
+    wavfile.write(path, SAMPLE_RATE, np.stack([tone, tone], axis=1))
+
+
+def test_gap_across_chunk_boundary_is_reported_whole(tmp_path):
+    path = str(tmp_path / 'gap.wav')
+    write_tone(path, 60, (28.5, 31.5))
+
+    reader = WavReader(path, chunk_s=30)
+    chunked = AudioDetector().process_chunks(reader.chunks(), discontinuity_detection=False, peak=reader.peak())
+    whole = AudioDetector().process(reader.samples, discontinuity_detection=False, peak=reader.peak())
+    reader.close()
+
+    assert len(chunked['gaps']) == 1
+    start, end = chunked['gaps'][0]
+    assert start == pytest.approx(28.5, abs=0.05)
+    assert end == pytest.approx(31.5, abs=0.05)
+    assert chunked['gaps'] == whole['gaps']
@@ -0,0 +1,75 @@
+import glob
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+pytest.importorskip('cv2')
+pytest.importorskip('pyaudio')
+pytest.importorskip('moviepy')
+
+import AudioVisualProcessor as processor_module
+from AudioVisualProcessor import AudioVisualProcessor
+from FrameBuffers import FrameQueue, VideoFramePool
+from IndexedSegment import IndexedSegmentReader, IndexedSegmentWriter
+from SegmentScheduler import SegmentScheduler
+
+
+class SlowIndexedSegmentWriter(IndexedSegmentWriter):
+    # Writes slower than frames arrive, so a short capture queue overflows while segments are streamed
+    def write(self, frame, capture_ns):
+        time.sleep(0.004)
+        return super().write(frame, capture_ns)
+
+
+def test_streamed_index_matches_sidecar_under_drop_oldest(tmp_path, monkeypatch):
+    monkeypatch.setattr(processor_module, 'IndexedSegmentWriter', SlowIndexedSegmentWriter)
+    save_path = f"{tmp_path}/"
+
+    pool = VideoFramePool(96, width=32, height=24)
+    frame_queue = FrameQueue(25, policy='drop-oldest', frame_pool=pool)
+    scheduler = SegmentScheduler(timeout_s=0.1)
+    video = SimpleNamespace(stream_open=True, video_device='test')
+    audio = SimpleNamespace(stream_open=False)
+    processor = AudioVisualProcessor(video_fps=10, video_shape=(32, 24), video_buffer_len_s=2, video_overlap_len_s=1,
+                                     video_save_path=save_path, video_container='mjpeg')
+
+    captured_ns = []
+    def capture():
+        try:
+            for i in range(300):
+                slot = pool.acquire()
+                pool.frames[slot][:] = i % 256
+                captured_ns.append(time.monotonic_ns())
+                frame_queue.append((captured_ns[-1], pool.frames[slot], slot))
+                scheduler.notify(frame_queue)
+                time.sleep(0.001)
+        finally:
+            video.stream_open = False
+            scheduler.notify()
+
+    capture_thread = threading.Thread(target=capture)
+    capture_thread.start()
+    processor.process(audio_module=audio, video_module=video, video_frames=frame_queue, audio_on=False,
+                      scheduler=scheduler, video_frame_pool=pool)
+    capture_thread.join()
+
+    sidecars = sorted(glob.glob(f"{save_path}*.timestamps.npz"))
+    assert len(sidecars) > 1
+
+    dropped_ns = set()
+    for sidecar_path in sidecars:
+        sidecar = np.load(sidecar_path)
+        reader = IndexedSegmentReader(sidecar_path.replace('.timestamps.npz', '.mjpeg'))
+        index_ns = reader.capture_times()
+        reader.close()
+
+        assert np.array_equal(index_ns, sidecar['capture_ns'])
+        assert not set(index_ns.tolist()) & set(sidecar['dropped_ns'].tolist())
+        dropped_ns.update(sidecar['dropped_ns'].tolist())
+
+    assert len(dropped_ns) > 0
+    assert dropped_ns <= set(captured_ns)